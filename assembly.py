@@ -0,0 +1,157 @@
+from audio import AudioArtifact
+from telemetry import get_logger, get_metrics
+from pathlib import Path
+import asyncio
+import json
+import logging
+import os
+import shutil
+
+FFMPEG = "ffmpeg"
+FFPROBE = "ffprobe"
+# every segment is encoded with the same settings, so their streams share one
+# set of H.264 parameters and the segments can be joined without re-encoding
+VIDEO_ENCODE = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-pix_fmt", "yuv420p"]
+# clips this close to the time left are used whole rather than cut
+TRIM_TOLERANCE = 0.05
+
+logger = get_logger("Assembly", logging.INFO)
+
+
+async def run_command(*args: str, input: bytes = None) -> bytes:
+    process = await asyncio.create_subprocess_exec(*args,
+                                                   stdin=None if input is None else asyncio.subprocess.PIPE,
+                                                   stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await process.communicate(input)
+    if process.returncode != 0:
+        raise RuntimeError(f"{args[0]} failed: {stderr.decode(errors='replace')[-2000:]}")
+    return stdout
+
+
+async def probe_video(path: Path) -> dict:
+    output = await run_command(FFPROBE, "-v", "error", "-select_streams", "v:0",
+                               "-show_entries", "stream=width,height,r_frame_rate,time_base:format=duration",
+                               "-of", "json", str(path))
+    info = json.loads(output)
+    stream = info['streams'][0]
+    return {
+        'duration': float(info['format']['duration']),
+        'width': stream['width'],
+        'height': stream['height'],
+        'frame_rate': stream['r_frame_rate'],
+        'timescale': stream['time_base'].split('/')[1],
+    }
+
+
+def plan_timeline(durations: list[float], target: float) -> list[tuple[int, float]]:
+    """Pieces covering `target` seconds as (clip index, seconds to keep).
+
+    Clips are used in order and cycled if they are too short in total; only
+    the last piece is cut, every other one is kept whole (seconds is None).
+    """
+    if not durations or min(durations) <= 0:
+        # a clip of no length would never cover the narration
+        raise ValueError(f"clip durations must be positive, got {durations}.")
+    pieces = []
+    total = 0.0
+    i = 0
+    while target - total > TRIM_TOLERANCE:
+        index = i % len(durations)
+        remaining = target - total
+        if durations[index] <= remaining + TRIM_TOLERANCE:
+            pieces.append((index, None))
+            total += durations[index]
+        else:
+            pieces.append((index, remaining))
+            total = target
+        i += 1
+    return pieces
+
+
+def write_concat_list(path: Path, files: list[Path]):
+    lines = [f"file '{Path(f).resolve()}'" for f in files]
+    path.write_text("\n".join(lines) + "\n")
+
+
+async def assemble_segment(index: int, audio: AudioArtifact, clips: list[Path], workdir: Path,
+                           video: dict) -> Path:
+    """Encode one chunk: its clips cut to the narration, in the `video` format.
+
+    Clips can come from different models, and so with different encoder
+    parameters, so they are decoded and encoded again in one pass rather than
+    stream-copied into a single track.
+    """
+    segment_dir = workdir / f"{index:03d}"
+    segment_dir.mkdir(parents=True, exist_ok=True)
+    audio_path = audio.path
+    if audio_path is None:
+        audio_path = segment_dir / "narration.mp3"
+        audio_path.write_bytes(audio.data)
+
+    infos = await asyncio.gather(*[probe_video(clip) for clip in clips])
+    timeline = plan_timeline([info['duration'] for info in infos], audio.duration_ms / 1000)
+
+    inputs = []
+    filters = []
+    for n, (clip_index, seconds) in enumerate(timeline):
+        inputs += ["-i", str(clips[clip_index])]
+        trim = "" if seconds is None else f"trim=duration={seconds:.3f},setpts=PTS-STARTPTS,"
+        filters.append(f"[{n}:v]{trim}scale={video['width']}:{video['height']},setsar=1,"
+                       f"fps={video['frame_rate']}[v{n}]")
+    labels = "".join(f"[v{n}]" for n in range(len(timeline)))
+    filters.append(f"{labels}concat=n={len(timeline)}:v=1:a=0[v]")
+
+    output = workdir / f"segment_{index:03d}.mp4"
+    await run_command(FFMPEG, "-y", "-v", "error", *inputs, "-i", str(audio_path),
+                      "-filter_complex", ";".join(filters),
+                      "-map", "[v]", "-map", f"{len(timeline)}:a", *VIDEO_ENCODE, "-c:a", "copy",
+                      "-video_track_timescale", video['timescale'], str(output))
+    shutil.rmtree(segment_dir, ignore_errors=True)
+    return output
+
+
+async def assemble_short(segments: list[tuple[AudioArtifact, list[Path]]], output: Path,
+                         workdir: Path = None, jobs: int = None) -> Path:
+    """Build the finished short from (narration, ordered clips) per chunk.
+
+    Chunks are encoded in parallel, up to `jobs` at a time (one per core by
+    default), in the format of the first clip, and then joined with a
+    stream-copy concat.
+    """
+    if shutil.which(FFMPEG) is None or shutil.which(FFPROBE) is None:
+        raise RuntimeError("ffmpeg and ffprobe are needed to assemble the short.")
+    output = Path(output)
+    workdir = Path(workdir) if workdir is not None else output.parent / "assembly"
+    workdir.mkdir(parents=True, exist_ok=True)
+    semaphore = asyncio.Semaphore(jobs or os.cpu_count() or 1)
+
+    # chunks too short to get a clip of their own borrow their neighbour's
+    filled = []
+    for i, (audio, clips) in enumerate(segments):
+        if not clips:
+            neighbours = [c for _, c in segments[i - 1::-1] if c] if i > 0 else []
+            neighbours += [c for _, c in segments[i + 1:] if c]
+            if not neighbours:
+                raise ValueError("there are no clips to assemble.")
+            clips = neighbours[0]
+        filled.append((audio, clips))
+    video = await probe_video(filled[0][1][0])
+
+    async def run(index, audio, clips):
+        async with semaphore:
+            logger.info(f"assembling segment {index}.")
+            with get_metrics().span('assembly_segment', attrs={'segment': index}):
+                return await assemble_segment(index, audio, clips, workdir, video)
+
+    parts = await asyncio.gather(*[run(i, audio, clips) for i, (audio, clips) in enumerate(filled)])
+
+    concat_list = workdir / "segments.txt"
+    write_concat_list(concat_list, parts)
+    await run_command(FFMPEG, "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", str(concat_list),
+                      "-c", "copy", "-movflags", "+faststart", str(output))
+    for part in parts:
+        part.unlink(missing_ok=True)
+    concat_list.unlink(missing_ok=True)
+    logger.info(f"short written to {output}.")
+    return output
@@ -0,0 +1,147 @@
+from pathlib import Path
+import io
+
+# bitrates in kbps indexed by [mpeg1][layer][index]; mpeg 2 and 2.5 share a table
+BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def parse_frame_header(header: bytes):
+    """Return (frame_length, samples, sample_rate) for an MP3 frame header,
+    or None if `header` is not a valid one."""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x03
+    layer = 4 - ((header[1] >> 1) & 0x03)
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    if layer == 3 and not mpeg1:
+        return 72 * bitrate // sample_rate + padding, 576, sample_rate
+    return 144 * bitrate // sample_rate + padding, 1152, sample_rate
+
+
+def id3v2_size(header: bytes) -> int:
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    size = 0
+    for b in header[6:10]:
+        size = (size << 7) | (b & 0x7F)
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def mp3_frames(f):
+    """Yield (offset, length, samples, sample_rate) for each audio frame of
+    the MP3 stream in the binary file `f`, skipping tags and Xing/Info frames."""
+    f.seek(0)
+    offset = id3v2_size(f.read(10))
+    first = True
+    while True:
+        f.seek(offset)
+        header = f.read(4)
+        if len(header) < 4:
+            break
+        frame = parse_frame_header(header)
+        if frame is None:
+            # lost sync: look for the next frame one byte further on
+            offset += 1
+            continue
+        length, frame_samples, sample_rate = frame
+        if first:
+            # a Xing/Info frame carries metadata, not audio
+            body = f.read(min(length, 64))
+            first = False
+            if b"Xing" in body or b"Info" in body:
+                offset += length
+                continue
+        yield offset, length, frame_samples, sample_rate
+        offset += length
+
+
+def mp3_duration(f) -> float:
+    """Duration in milliseconds of the MP3 stream in the binary file `f`,
+    counted from frame headers without decoding any audio."""
+    samples = 0
+    sample_rate = None
+    for _, _, frame_samples, sample_rate in mp3_frames(f):
+        samples += frame_samples
+
+    if not sample_rate:
+        return 0.0
+    return samples / sample_rate * 1000
+
+
+def split_mp3(data: bytes, cuts_ms: list[float]) -> list[bytes]:
+    """Split MP3 `data` at the frame boundaries nearest to `cuts_ms`.
+
+    Returns len(cuts_ms) + 1 pieces; frames are copied as they are, so no
+    audio is decoded or re-encoded.
+    """
+    pieces = [bytearray() for _ in range(len(cuts_ms) + 1)]
+    f = io.BytesIO(data)
+    elapsed = 0.0
+    piece = 0
+    for offset, length, samples, sample_rate in mp3_frames(f):
+        duration = samples / sample_rate * 1000
+        # a frame goes to the piece its midpoint falls in
+        while piece < len(cuts_ms) and elapsed + duration / 2 >= cuts_ms[piece]:
+            piece += 1
+        pieces[piece].extend(data[offset:offset + length])
+        elapsed += duration
+    return [bytes(p) for p in pieces]
+
+
+class AudioArtifact:
+    """MP3 audio kept exactly as the provider returned it.
+
+    `len()` gives the duration in milliseconds like pydub's AudioSegment, but
+    is read from the frame headers; `to_segment()` decodes to PCM only for
+    the consumers that actually need samples.
+    """
+
+    def __init__(self, data: bytes = None, path: Path = None, duration_ms: float = None):
+        if data is None and path is None:
+            raise ValueError("an audio artifact needs either data or a path.")
+        self.data = data
+        self.path = Path(path) if path is not None else None
+        self._duration_ms = duration_ms
+
+    def read_bytes(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        return self.path.read_bytes()
+
+    @property
+    def duration_ms(self) -> float:
+        if self._duration_ms is None:
+            if self.data is not None:
+                self._duration_ms = mp3_duration(io.BytesIO(self.data))
+            else:
+                with open(self.path, "rb") as f:
+                    self._duration_ms = mp3_duration(f)
+        return self._duration_ms
+
+    def __len__(self) -> int:
+        return round(self.duration_ms)
+
+    def to_segment(self):
+        from pydub import AudioSegment
+        if self.path is not None:
+            return AudioSegment.from_mp3(self.path)
+        return AudioSegment.from_mp3(io.BytesIO(self.data))
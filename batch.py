@@ -0,0 +1,63 @@
+from main import run_job, STORE_MAX_BYTES
+from store import ArtifactStore
+from clients import close_clients
+from telemetry import get_logger, get_metrics
+from utils import generate_hash
+from pathlib import Path
+import argparse
+import asyncio
+import logging
+import sys
+
+METRICS_DIR = Path(".cache/metrics")
+
+logger = get_logger("Batch", logging.INFO)
+
+
+def read_queries(path: str) -> list[str]:
+    lines = Path(path).read_text().splitlines()
+    return [line.strip() for line in lines if line.strip() and not line.startswith("#")]
+
+
+async def run_batch(queries: list[str]):
+    # jobs share one store and, through limits.get_limiter, one set of
+    # provider concurrency limits
+    store = ArtifactStore(max_bytes=STORE_MAX_BYTES)
+    job_ids = [generate_hash(query) for query in queries]
+
+    async def run(query, job_id):
+        logger.info(f"job {job_id} started: {query}")
+        save_dir = await run_job(query, job_id=job_id, store=store)
+        logger.info(f"job {job_id} completed in {save_dir}")
+        return save_dir
+
+    try:
+        results = await asyncio.gather(*[run(query, job_id) for query, job_id in zip(queries, job_ids)],
+                                       return_exceptions=True)
+    finally:
+        await close_clients()
+        get_metrics().export(METRICS_DIR)
+    for query, job_id, result in zip(queries, job_ids, results):
+        if isinstance(result, Exception):
+            logger.error(f"job {job_id} failed: {result!r}")
+
+    return dict(zip(job_ids, results))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run many shorts concurrently.")
+    parser.add_argument("queries", nargs="*", help="queries to run")
+    parser.add_argument("-f", "--file", help="file with one query per line")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    queries = list(args.queries)
+    if args.file:
+        queries += read_queries(args.file)
+    # the same query twice would share a job id and cache namespace
+    queries = list(dict.fromkeys(queries))
+    if not queries:
+        sys.exit("no queries given.")
+    asyncio.run(run_batch(queries))
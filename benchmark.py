@@ -0,0 +1,182 @@
+from pathlib import Path
+from datetime import datetime
+import argparse
+import asyncio
+import json
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = Path(__file__).resolve().parent
+# provider concurrency limits per profile; the fakes enforce them too
+PROFILES = {
+    'low': {'openai': 4, 'elevenlabs': 2, 'veo': 1},
+    'default': {'openai': 8, 'elevenlabs': 3, 'veo': 2},
+    'high': {'openai': 16, 'elevenlabs': 6, 'veo': 4},
+}
+BENCHMARK_DIR = Path(".cache/benchmarks")
+
+
+async def run_worker(config: dict) -> dict:
+    """Run one job of `main.py` against the fake providers in this process."""
+    from fake_providers import FakeProvider, FakeOpenAI, FakeElevenLabs, FakeGenai
+    from store import ArtifactStore
+    from telemetry import get_metrics
+    import clients
+    import limits
+    import veo_poller
+    import main
+
+    profile = PROFILES[config['profile']]
+    for provider, concurrency in profile.items():
+        limits.PROVIDER_LIMITS[provider] = {'rpm': None, 'concurrency': concurrency,
+                                            'max_concurrency': concurrency}
+    generation = tuple(config['veo_latency'])
+    veo_poller.EXPECTED_SECONDS = sum(generation) / 2
+    veo_poller.MIN_INTERVAL = 0.2
+    veo_poller.MAX_INTERVAL = 2.0
+    main.ASSEMBLE = False
+    # the fakes' MP3 frames hold no audio worth decoding
+    main.PROCESS_AUDIO = False
+    main.STREAM_SCRIPT = config.get('stream', False)
+    main.VOICE_BATCH_CHARS = config.get('voice_batch')
+
+    failure_rate = config['failure_rate']
+    clients.set_client_override('openai', FakeOpenAI(
+        FakeProvider(profile['openai'], latency=tuple(config['openai_latency']), failure_rate=failure_rate),
+        chunks=config['chunks']))
+    clients.set_client_override('elevenlabs', FakeElevenLabs(
+        FakeProvider(profile['elevenlabs'], latency=tuple(config['tts_latency']), failure_rate=failure_rate)))
+    clients.set_client_override('google', FakeGenai(
+        FakeProvider(profile['veo'], latency=(0.05, 0.2), failure_rate=failure_rate),
+        generation_latency=generation, failure_rate=failure_rate))
+
+    start = time.perf_counter()
+    await main.run_job(f"benchmark with {config['chunks']} chunks", store=ArtifactStore())
+    wall = time.perf_counter() - start
+
+    stages = {}
+    for event in get_metrics().events:
+        if event['name'] != 'stage':
+            continue
+        stage = stages.setdefault(event['labels']['stage'], {'count': 0, 'busy': 0.0, 'first': None,
+                                                             'first_end': None, 'last': 0.0})
+        stage['count'] += 1
+        stage['busy'] += event['duration']
+        end = event['start'] + event['duration']
+        stage['first'] = event['start'] if stage['first'] is None else min(stage['first'], event['start'])
+        stage['first_end'] = end if stage['first_end'] is None else min(stage['first_end'], end)
+        stage['last'] = max(stage['last'], end)
+
+    context_tokens = {dict(labels)['kind']: int(value) for (metric, labels), value
+                      in get_metrics().counters.items() if metric == 'context_tokens_total'}
+
+    job_start = min((s['first'] for s in stages.values()), default=0.0)
+    first_audio = stages['voice']['first_end'] - job_start if 'voice' in stages else None
+    return {
+        'chunks': config['chunks'],
+        'profile': config['profile'],
+        'stream': main.STREAM_SCRIPT,
+        'wall_seconds': round(wall, 3),
+        'first_audio_seconds': None if first_audio is None else round(first_audio, 3),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        # lore sent to VeoPrompter, as the whole context and as digests
+        'context_tokens': context_tokens,
+        'stages': {name: {'count': s['count'],
+                          'busy_seconds': round(s['busy'], 3),
+                          'wall_seconds': round(s['last'] - s['first'], 3)}
+                   for name, s in stages.items()},
+    }
+
+
+def run_scenario(config: dict) -> dict:
+    # every scenario gets a fresh process and working directory, so caches,
+    # registries and peak RSS don't leak between scenarios
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in ("prompts.json", "context.txt"):
+            if (ROOT / name).exists():
+                shutil.copy(ROOT / name, workdir)
+        if (ROOT / "references").exists():
+            shutil.copytree(ROOT / "references", Path(workdir) / "references")
+        result_path = Path(workdir) / "result.json"
+        config = {**config, 'result_path': str(result_path)}
+        with open(Path(workdir) / "worker.log", "w") as log:
+            process = subprocess.run([sys.executable, str(ROOT / "benchmark.py"), "--worker", json.dumps(config)],
+                                     cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+        if process.returncode != 0:
+            tail = (Path(workdir) / "worker.log").read_text()[-2000:]
+            raise RuntimeError(f"scenario {config['chunks']}/{config['profile']} failed:\n{tail}")
+        return json.loads(result_path.read_text())
+
+
+def compare(results: list[dict], baseline: list[dict]):
+    previous = {(r['chunks'], r['profile'], r.get('stream', False)): r for r in baseline}
+    for result in results:
+        before = previous.get((result['chunks'], result['profile'], result['stream']))
+        if before is None:
+            continue
+        change = (result['wall_seconds'] - before['wall_seconds']) / before['wall_seconds'] * 100
+        rss = result['peak_rss_mb'] - before['peak_rss_mb']
+        print(f"{result['chunks']:>6} {result['profile']:>8}  wall {change:+.1f}%  rss {rss:+.1f} MB")
+
+
+def report(results: list[dict]):
+    print(f"{'chunks':>6} {'profile':>8} {'wall s':>8} {'audio s':>8} {'rss MB':>8}  stages (wall s / busy s)")
+    for r in results:
+        stages = "  ".join(f"{name} {s['wall_seconds']:.1f}/{s['busy_seconds']:.1f}"
+                           for name, s in r['stages'].items())
+        profile = r['profile'] + ("+s" if r['stream'] else "")
+        print(f"{r['chunks']:>6} {profile:>8} {r['wall_seconds']:>8.2f} {r['first_audio_seconds'] or 0:>8.2f} "
+              f"{r['peak_rss_mb']:>8.1f}  {stages}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against fake providers.")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--profiles", nargs="+", default=["low", "default", "high"], choices=list(PROFILES))
+    parser.add_argument("--openai-latency", type=float, nargs=2, default=[0.2, 0.5])
+    parser.add_argument("--tts-latency", type=float, nargs=2, default=[0.3, 0.8])
+    parser.add_argument("--veo-latency", type=float, nargs=2, default=[3.0, 6.0])
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--stream", action="store_true", help="stream the script and chunk it locally")
+    parser.add_argument("--voice-batch", type=int, help="character budget of coalesced TTS requests")
+    parser.add_argument("--baseline", help="earlier benchmark output to compare against")
+    parser.add_argument("--output", help="where to write the results (JSON)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.worker:
+        config = json.loads(args.worker)
+        result = asyncio.run(run_worker(config))
+        Path(config['result_path']).write_text(json.dumps(result))
+        sys.exit(0)
+
+    results = []
+    for chunks in args.chunks:
+        for profile in args.profiles:
+            results.append(run_scenario({
+                'chunks': chunks,
+                'profile': profile,
+                'openai_latency': args.openai_latency,
+                'tts_latency': args.tts_latency,
+                'veo_latency': args.veo_latency,
+                'failure_rate': args.failure_rate,
+                'stream': args.stream,
+                'voice_batch': args.voice_batch,
+            }))
+    report(results)
+
+    output = Path(args.output) if args.output else \
+        BENCHMARK_DIR / f"{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=1))
+    print(f"results written to {output}")
+    if args.baseline:
+        compare(results, json.loads(Path(args.baseline).read_text()))
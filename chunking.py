@@ -0,0 +1,41 @@
+import re
+
+# chunks are cut at paragraph breaks once they reach MIN_CHUNK_CHARS, and at
+# a sentence end when a paragraph runs past MAX_CHUNK_CHARS
+MIN_CHUNK_CHARS = 200
+MAX_CHUNK_CHARS = 600
+SENTENCE_END = re.compile(r"[.!?…][\"')\]]*\s+")
+
+
+def next_cut(text: str, min_chars: int, max_chars: int) -> int:
+    """Where the first chunk of `text` ends, or None if it isn't settled yet."""
+    for match in re.finditer(r"\n\s*\n", text):
+        if len(text[:match.start()].strip()) >= min_chars:
+            return match.end()
+    if len(text) > max_chars:
+        cuts = [m.end() for m in SENTENCE_END.finditer(text, 0, max_chars)
+                if len(text[:m.end()].strip()) >= min_chars]
+        if cuts:
+            return cuts[-1]
+    return None
+
+
+async def split_stream(deltas, min_chars: int = MIN_CHUNK_CHARS, max_chars: int = MAX_CHUNK_CHARS):
+    """Yield chunks of a script while it is still being written.
+
+    Like ChunkerAgent's, the chunks are verbatim slices of the script. A
+    chunk is only emitted once the text after it has started, so nothing
+    still being generated can change it.
+    """
+    buffer = ""
+    async for delta in deltas:
+        buffer += delta
+        while True:
+            cut = next_cut(buffer, min_chars, max_chars)
+            if cut is None:
+                break
+            chunk, buffer = buffer[:cut].strip(), buffer[cut:]
+            if chunk:
+                yield chunk
+    if buffer.strip():
+        yield buffer.strip()
@@ -0,0 +1,108 @@
+from typing import TYPE_CHECKING
+import os
+
+# the SDKs are imported by the getters, on first use: together they take
+# over a second to import, which a run served from caches doesn't need
+if TYPE_CHECKING:
+    from elevenlabs.client import AsyncElevenLabs
+    from google import genai
+    import httpx
+    import openai
+
+# connections kept per provider; sized above the concurrency limits in
+# main.py so that polling and downloads don't queue behind generation calls
+POOL_SIZES = {
+    'openai': 16,
+    'elevenlabs': 8,
+    'google': 8,
+}
+
+_clients = {}
+_closers = []
+# stand-in clients (see fake_providers.py) returned instead of real ones
+_overrides = {}
+
+
+def _limits(provider: str):
+    import httpx
+    size = POOL_SIZES[provider]
+    return httpx.Limits(max_connections=size, max_keepalive_connections=size)
+
+
+def set_client_override(provider: str, client):
+    if client is None:
+        _overrides.pop(provider, None)
+    else:
+        _overrides[provider] = client
+
+
+def get_openai_client(api_key: str = None) -> "openai.AsyncOpenAI":
+    if 'openai' in _overrides:
+        return _overrides['openai']
+    if api_key is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+    key = ('openai', api_key)
+    if key not in _clients:
+        import openai
+        http_client = openai.DefaultAsyncHttpxClient(limits=_limits('openai'))
+        client = openai.AsyncOpenAI(api_key=api_key, http_client=http_client)
+        _clients[key] = client
+        _closers.append(client.close)
+    return _clients[key]
+
+
+def get_elevenlabs_client(api_key: str = None) -> "AsyncElevenLabs":
+    if 'elevenlabs' in _overrides:
+        return _overrides['elevenlabs']
+    if api_key is None:
+        api_key = os.getenv("ELEVENLABS_API_KEY")
+    key = ('elevenlabs', api_key)
+    if key not in _clients:
+        from elevenlabs.client import AsyncElevenLabs
+        import httpx
+        http_client = httpx.AsyncClient(limits=_limits('elevenlabs'), timeout=240)
+        client = AsyncElevenLabs(api_key=api_key, httpx_client=http_client)
+        _clients[key] = client
+        _closers.append(http_client.aclose)
+    return _clients[key]
+
+
+def get_genai_client(api_key: str = None) -> "genai.Client":
+    if 'google' in _overrides:
+        return _overrides['google']
+    if api_key is None:
+        api_key = os.getenv("GOOGLE_API_KEY")
+    key = ('google', api_key)
+    if key not in _clients:
+        from google.genai import types
+        from google import genai
+        import httpx
+        http_client = httpx.AsyncClient(limits=_limits('google'))
+        client = genai.Client(api_key=api_key,
+                              http_options=types.HttpOptions(httpx_async_client=http_client))
+        _clients[key] = client
+        _clients[('google-http', api_key)] = http_client
+        _closers.append(client.aio.aclose)
+        _closers.append(http_client.aclose)
+    return _clients[key]
+
+
+def get_genai_http_client(api_key: str = None) -> "httpx.AsyncClient":
+    # the pool behind the genai client, for streaming file downloads; an
+    # installed override has none, so None tells callers to go through it
+    if 'google' in _overrides:
+        return None
+    if api_key is None:
+        api_key = os.getenv("GOOGLE_API_KEY")
+    get_genai_client(api_key)
+    return _clients[('google-http', api_key)]
+
+
+async def close_clients():
+    while _closers:
+        close = _closers.pop(0)
+        try:
+            await close()
+        except Exception:
+            pass
+    _clients.clear()
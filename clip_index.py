@@ -0,0 +1,113 @@
+from pathlib import Path
+from hashlib import blake2b
+import json
+import random
+import re
+import sqlite3
+
+NUM_PERM = 64
+SHINGLE_SIZE = 3
+MERSENNE_PRIME = (1 << 61) - 1
+INSTRUCTIONS_MARKER = "### VIDEO INSTRUCTIONS ###"
+
+_indexes = {}
+
+_rng = random.Random(1)
+PERMUTATIONS = [(_rng.randrange(1, MERSENNE_PRIME), _rng.randrange(0, MERSENNE_PRIME))
+                for _ in range(NUM_PERM)]
+
+
+def normalize_description(description: str) -> list[str]:
+    # the lore context prepended by VeoPrompter is shared by every clip, so
+    # only the instructions themselves take part in the fingerprint
+    if INSTRUCTIONS_MARKER in description:
+        description = description.split(INSTRUCTIONS_MARKER, 1)[1]
+    return re.findall(r"\w+", description.lower())
+
+
+def shingles(words: list[str], size: int = SHINGLE_SIZE) -> set[str]:
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(description: str) -> list[int]:
+    hashes = [int.from_bytes(blake2b(s.encode(), digest_size=8).digest(), "big")
+              for s in shingles(normalize_description(description))]
+    if not hashes:
+        return [MERSENNE_PRIME] * NUM_PERM
+    return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS]
+
+
+def similarity(first: list[int], second: list[int]) -> float:
+    return sum(1 for x, y in zip(first, second) if x == y) / NUM_PERM
+
+
+class ClipIndex:
+    """Index of generated clips by a MinHash fingerprint of their description.
+
+    `find` returns the stored clip whose description is most similar to the
+    given one, among clips generated with the same `variant` (aspect ratio,
+    duration, reference images) and not by `exclude_job`, if the estimated
+    Jaccard similarity reaches `threshold`.
+    """
+
+    def __init__(self, path: Path = Path(".cache/clips.sqlite")):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("CREATE TABLE IF NOT EXISTS clips ("
+                        "key TEXT PRIMARY KEY, variant TEXT, description TEXT, signature TEXT, job TEXT)")
+        # indexes made before clips recorded their job
+        if "job" not in [row[1] for row in self.db.execute("PRAGMA table_info(clips)")]:
+            self.db.execute("ALTER TABLE clips ADD COLUMN job TEXT")
+        self.db.execute("CREATE INDEX IF NOT EXISTS clips_variant ON clips (variant)")
+        self.db.commit()
+        self._signatures = {}
+        self._jobs = {}
+
+    def _load(self, variant: str) -> dict:
+        if variant not in self._signatures:
+            rows = self.db.execute("SELECT key, signature, job FROM clips WHERE variant = ?", (variant,))
+            self._signatures[variant] = {}
+            for key, signature, job in rows:
+                self._signatures[variant][key] = json.loads(signature)
+                self._jobs[key] = job
+        return self._signatures[variant]
+
+    def add(self, key: str, description: str, variant: str, job: str = None):
+        signature = minhash(description)
+        self.db.execute("INSERT OR REPLACE INTO clips (key, variant, description, signature, job) "
+                        "VALUES (?, ?, ?, ?, ?)", (key, variant, description, json.dumps(signature), job))
+        self.db.commit()
+        self._load(variant)[key] = signature
+        self._jobs[key] = job
+
+    def remove(self, key: str):
+        self.db.execute("DELETE FROM clips WHERE key = ?", (key,))
+        self.db.commit()
+        for signatures in self._signatures.values():
+            signatures.pop(key, None)
+        self._jobs.pop(key, None)
+
+    def find(self, description: str, variant: str, threshold: float,
+             exclude_job: str = None) -> tuple[str, float]:
+        signature = minhash(description)
+        best_key, best_score = None, 0.0
+        for key, other in self._load(variant).items():
+            # a job's own clips are other shots of the same short, however
+            # alike their descriptions read
+            if exclude_job is not None and self._jobs.get(key) == exclude_job:
+                continue
+            score = similarity(signature, other)
+            if score > best_score:
+                best_key, best_score = key, score
+        if best_key is None or best_score < threshold:
+            return None, best_score
+        return best_key, best_score
+
+
+def get_clip_index() -> ClipIndex:
+    if 'default' not in _indexes:
+        _indexes['default'] = ClipIndex()
+    return _indexes['default']
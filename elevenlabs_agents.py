@@ -1,10 +1,10 @@
 from my_agents import Agent
-from elevenlabs.client import AsyncElevenLabs
-import os
-import asyncio
+from clients import get_elevenlabs_client
+from limits import AdaptiveLimiter, get_limiter
+from audio import AudioArtifact, split_mp3
+from telemetry import get_metrics
+import base64
 import logging
-from pydub import AudioSegment
-import io
 
 
 class VoiceGenerationAgent(Agent):
@@ -13,24 +13,21 @@ class VoiceGenerationAgent(Agent):
                  voice_id: str,
                  model: str,
                  api_key: str = None,
-                 semaphore: asyncio.Semaphore = None,
+                 limiter: AdaptiveLimiter = None,
                  settings: dict = None):
-        if api_key is None:
-            api_key = os.getenv("ELEVENLABS_API_KEY")
-        client = AsyncElevenLabs(api_key=api_key)
-        super().__init__(name, client, model)
+        super().__init__(name, None, model)
+        self.api_key = api_key
         self.voice_id = voice_id
         self.settings = settings if settings is not None else {}
-        self.semaphore = semaphore
+        self.limiter = limiter if limiter is not None else get_limiter('elevenlabs', model)
 
-    async def run(self, text: str) -> AudioSegment:
-        if self.semaphore is None:
-            result = await self._run(text,)
-            return result
+    def _connect(self):
+        return get_elevenlabs_client(self.api_key)
 
-        async with self.semaphore:
-            result = await self._run(text)
-            return result
+    async def run(self, text: str) -> AudioArtifact:
+        with self.span('agent_run'):
+            result = await self.limiter.call(self._run, text)
+        return result
 
     async def _run(self, text: str):
         self.log("started.", logging.INFO)
@@ -48,6 +45,50 @@ class VoiceGenerationAgent(Agent):
             buffer.extend(chunk)
 
         self.log("completed.", logging.INFO)
+        get_metrics().inc('bytes_downloaded_total', len(buffer), provider='elevenlabs')
 
-        audio = AudioSegment.from_mp3(io.BytesIO(buffer))
-        return audio
+        # keep the provider's mp3 as is; decoding happens only if needed
+        return AudioArtifact(bytes(buffer))
+
+    async def run_coalesced(self, texts: list[str]) -> list[AudioArtifact]:
+        """Voice neighbouring `texts` in one request and split the audio back.
+
+        The texts are read as one passage, so prosody carries across them;
+        the cuts are placed between the character timestamps of the last
+        character of a text and the first of the next.
+        """
+        with self.span('agent_run'):
+            result = await self.limiter.call(self._run_coalesced, texts)
+        return result
+
+    async def _run_coalesced(self, texts: list[str]) -> list[AudioArtifact]:
+        self.log(f"started, {len(texts)} texts in one request.", logging.INFO)
+        text = " ".join(texts)
+        self.log("awaiting for response.")
+        response = await self.client.text_to_speech.convert_with_timestamps(
+            self.voice_id,
+            text=text,
+            model_id=self.model,
+            output_format="mp3_44100_128",
+            voice_settings=self.settings
+        )
+        data = base64.b64decode(response.audio_base_64)
+        get_metrics().inc('bytes_downloaded_total', len(data), provider='elevenlabs')
+
+        alignment = response.alignment
+        starts = alignment.character_start_times_seconds
+        ends = alignment.character_end_times_seconds
+        # the alignment usually has one entry per input character; if not,
+        # place the cuts proportionally to the text
+        scale = 1.0 if len(starts) == len(text) else len(starts) / len(text)
+        cuts = []
+        position = 0
+        for previous in texts[:-1]:
+            position += len(previous)
+            last = min(len(ends) - 1, max(0, int((position - 1) * scale)))
+            first = min(len(starts) - 1, int((position + 1) * scale))
+            cuts.append((ends[last] + starts[first]) / 2 * 1000)
+            position += 1
+
+        self.log("completed.", logging.INFO)
+        return [AudioArtifact(piece) for piece in split_mp3(data, cuts)]
@@ -0,0 +1,290 @@
+from limits import AdaptiveLimiter
+from types import SimpleNamespace
+import asyncio
+import base64
+import itertools
+import random
+import re
+import sys
+import time
+
+# one MPEG-1 layer III frame, 128 kbps at 44.1 kHz, lasting 1152 samples
+MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)
+MP3_FRAME_SECONDS = 1152 / 44100
+
+
+class FakeProviderError(Exception):
+    def __init__(self, status_code: int, retry_after: float = None):
+        super().__init__(f"fake provider returned {status_code}")
+        self.status_code = status_code
+        self.headers = {} if retry_after is None else {'retry-after': str(retry_after)}
+
+
+class FakeProvider:
+    """Local stand-in for a rate-limited API.
+
+    Rejects calls with 429 when more than `max_concurrency` are in flight or
+    when the calls started in the last `window` seconds exceed `rpm` scaled
+    to that window, and with 503 at `failure_rate`.
+    """
+
+    def __init__(self,
+                 max_concurrency: int,
+                 rpm: float = None,
+                 window: float = 60.0,
+                 latency: tuple[float, float] = (0.05, 0.1),
+                 failure_rate: float = 0.0,
+                 retry_after: float = None):
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.window = window
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.retry_after = retry_after
+
+        self.active = 0
+        self.peak = 0
+        self.calls = 0
+        self.rejected = 0
+        self._starts = []
+
+    async def request(self, latency: tuple[float, float] = None):
+        now = time.monotonic()
+        self.calls += 1
+        self._starts = [t for t in self._starts if now - t < self.window]
+        if self.active >= self.max_concurrency or \
+                (self.rpm is not None and len(self._starts) >= self.rpm * self.window / 60):
+            self.rejected += 1
+            raise FakeProviderError(429, self.retry_after)
+        if random.random() < self.failure_rate:
+            self.rejected += 1
+            raise FakeProviderError(503)
+
+        self._starts.append(now)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(random.uniform(*(latency or self.latency)))
+        finally:
+            self.active -= 1
+        return "ok"
+
+
+class FakeOpenAI:
+    """Stand-in for `openai.AsyncOpenAI` as used by OpenaiAgent.
+
+    `responses.create` writes a script of `chunks` paragraphs at
+    `chars_per_second`, streamed as text deltas with `stream=True`;
+    `responses.parse` splits a script on blank lines or returns as many
+    descriptions as the prompt's `versions` asks for, and
+    `vector_stores.search` returns lore.
+    """
+
+    def __init__(self, provider: FakeProvider, chunks: int = 6, chars_per_chunk: int = 150,
+                 chars_per_second: float = 300.0):
+        self.provider = provider
+        self.chunks = chunks
+        self.chars_per_chunk = chars_per_chunk
+        self.chars_per_second = chars_per_second
+        self.responses = SimpleNamespace(create=self._create, parse=self._parse)
+        self.vector_stores = SimpleNamespace(search=self._search)
+        self._ids = itertools.count()
+
+    @staticmethod
+    def _usage(messages: list, output: str):
+        prompt = " ".join(m['content'] for m in messages)
+        return SimpleNamespace(input_tokens=len(prompt) // 4, output_tokens=len(output) // 4)
+
+    @staticmethod
+    def _field(messages: list, key: str) -> str:
+        match = re.search(rf"### {key} ###\n(.*?)\n\n###", messages[-1]['content'], re.S)
+        return match.group(1) if match else None
+
+    def _sentence(self) -> str:
+        return f"Scene {next(self._ids)} drifts across the tidal ocean under twin moons."
+
+    async def _create(self, model: str, input: list, stream: bool = False, **kwargs):
+        await self.provider.request()
+        paragraphs = []
+        for _ in range(self.chunks):
+            paragraph = ""
+            while len(paragraph) < self.chars_per_chunk:
+                paragraph += self._sentence() + " "
+            paragraphs.append(paragraph.strip())
+        text = "\n\n".join(paragraphs)
+        usage = self._usage(input, text)
+        if stream:
+            return self._stream(text, usage)
+        await asyncio.sleep(len(text) / self.chars_per_second)
+        return SimpleNamespace(output_text=text, usage=usage)
+
+    async def _stream(self, text: str, usage):
+        for start in range(0, len(text), 16):
+            await asyncio.sleep(16 / self.chars_per_second)
+            yield SimpleNamespace(type="response.output_text.delta", delta=text[start:start + 16])
+        yield SimpleNamespace(type="response.completed", response=SimpleNamespace(usage=usage))
+
+    async def _parse(self, model: str, input: list, text_format, **kwargs):
+        await self.provider.request()
+        versions = self._field(input, "versions")
+        if versions is not None:
+            descriptions = [f"Clip {next(self._ids)}: " + self._sentence() for _ in range(int(versions))]
+        else:
+            script = self._field(input, "script") or ""
+            descriptions = [p for p in script.split("\n\n") if p.strip()]
+        parsed = text_format(descriptions=descriptions)
+        return SimpleNamespace(output_parsed=parsed, usage=self._usage(input, " ".join(descriptions)))
+
+    async def _search(self, vector_store_id: str, query: str, **kwargs):
+        await self.provider.request()
+        data = {'data': [{'content': [{'type': 'text', 'text': "The Ortheans live in floating cities."}]}]}
+        return SimpleNamespace(model_dump=lambda: data)
+
+    async def close(self):
+        pass
+
+
+class FakeElevenLabs:
+    """Stand-in for `AsyncElevenLabs`: streams valid MP3 frames lasting
+    `len(text) / chars_per_second` seconds, or returns them base64 encoded
+    with evenly spaced character timestamps."""
+
+    def __init__(self, provider: FakeProvider, chars_per_second: float = 15.0):
+        self.provider = provider
+        self.chars_per_second = chars_per_second
+        self.text_to_speech = SimpleNamespace(convert=self._convert,
+                                              convert_with_timestamps=self._convert_with_timestamps)
+
+    async def _convert(self, text: str, **kwargs):
+        await self.provider.request()
+        frames = round(len(text) / self.chars_per_second / MP3_FRAME_SECONDS)
+        for start in range(0, frames, 100):
+            yield MP3_FRAME * min(100, frames - start)
+
+    async def _convert_with_timestamps(self, voice_id: str, text: str, **kwargs):
+        await self.provider.request()
+        frames = round(len(text) / self.chars_per_second / MP3_FRAME_SECONDS)
+        per_char = 1 / self.chars_per_second
+        alignment = SimpleNamespace(characters=list(text),
+                                    character_start_times_seconds=[i * per_char for i in range(len(text))],
+                                    character_end_times_seconds=[(i + 1) * per_char for i in range(len(text))])
+        return SimpleNamespace(audio_base_64=base64.b64encode(MP3_FRAME * frames).decode(),
+                               alignment=alignment, normalized_alignment=alignment)
+
+
+class FakeGenai:
+    """Stand-in for `genai.Client` covering `aio.models.generate_videos`,
+    `aio.operations.get` and `aio.files.download`.
+
+    Submissions go through `provider`; each operation completes after a
+    delay drawn from `generation_latency`, with `failure_rate` of them
+    finishing with an error; `models` overrides either per model name.
+    """
+
+    def __init__(self,
+                 provider: FakeProvider,
+                 generation_latency: tuple[float, float] = (3.0, 6.0),
+                 poll_latency: tuple[float, float] = (0.01, 0.03),
+                 failure_rate: float = 0.0,
+                 clip_bytes: int = 2 * 1024 ** 2,
+                 models: dict[str, dict] = None):
+        self.provider = provider
+        self.generation_latency = generation_latency
+        self.poll_latency = poll_latency
+        self.failure_rate = failure_rate
+        self.clip_bytes = clip_bytes
+        self.models = models or {}
+        self.operations = {}
+        self.aio = SimpleNamespace(
+            models=SimpleNamespace(generate_videos=self._generate_videos),
+            operations=SimpleNamespace(get=self._get),
+            files=SimpleNamespace(download=self._download),
+            aclose=self._aclose,
+        )
+        self._ids = itertools.count()
+
+    async def _generate_videos(self, model: str, prompt: str, config=None, **kwargs):
+        await self.provider.request()
+        overrides = self.models.get(model, {})
+        name = f"operations/fake-{next(self._ids)}"
+        self.operations[name] = {
+            'ready_at': time.monotonic() + random.uniform(*overrides.get('generation_latency',
+                                                                         self.generation_latency)),
+            'failed': random.random() < overrides.get('failure_rate', self.failure_rate),
+        }
+        return SimpleNamespace(name=name, done=False, error=None, response=None)
+
+    async def _get(self, operation):
+        await asyncio.sleep(random.uniform(*self.poll_latency))
+        state = self.operations[operation.name]
+        if time.monotonic() < state['ready_at']:
+            return SimpleNamespace(name=operation.name, done=False, error=None, response=None)
+        if state['failed']:
+            return SimpleNamespace(name=operation.name, done=True,
+                                   error={'message': 'fake generation failed'}, response=None)
+        video = SimpleNamespace(video_bytes=bytes(self.clip_bytes), uri=None)
+        response = SimpleNamespace(generated_videos=[SimpleNamespace(video=video)])
+        return SimpleNamespace(name=operation.name, done=True, error=None, response=response)
+
+    async def _download(self, file):
+        return file.video_bytes
+
+    async def _aclose(self):
+        pass
+
+
+async def check_limiter(provider: FakeProvider, limiter: AdaptiveLimiter, requests: int):
+    start = time.monotonic()
+    results = await asyncio.gather(*[limiter.call(provider.request) for _ in range(requests)],
+                                   return_exceptions=True)
+    elapsed = time.monotonic() - start
+    failures = [r for r in results if isinstance(r, Exception)]
+    return {
+        'requests': requests,
+        'failures': len(failures),
+        'elapsed': round(elapsed, 2),
+        'provider_calls': provider.calls,
+        'rejected': provider.rejected,
+        'peak_concurrency': provider.peak,
+        'final_concurrency': round(limiter.concurrency, 2),
+    }
+
+
+async def check_convergence():
+    # concurrency-limited provider: starting at 1, AIMD should climb to the
+    # provider's limit and hover around it without failing requests
+    provider = FakeProvider(max_concurrency=4)
+    limiter = AdaptiveLimiter("fake:concurrency", concurrency=1, max_concurrency=16,
+                              base_delay=0.05, cooldown=0.1)
+    report = await check_limiter(provider, limiter, 300)
+    print("concurrency limit:", report)
+    assert report['failures'] == 0
+    assert report['peak_concurrency'] == 4
+    assert 2 <= report['final_concurrency'] <= 8
+    assert report['rejected'] < report['requests'] * 0.25
+
+    # rpm-limited provider with Retry-After, checked over one-second windows:
+    # a bucket set 10% under the limit should keep it close to zero rejections
+    provider = FakeProvider(max_concurrency=100, rpm=600, window=1.0, retry_after=0.1)
+    limiter = AdaptiveLimiter("fake:rpm", rpm=540, concurrency=4, max_concurrency=16,
+                              base_delay=0.05, cooldown=0.1)
+    report = await check_limiter(provider, limiter, 60)
+    print("rpm limit:", report)
+    assert report['failures'] == 0
+    assert report['rejected'] <= 2
+
+    # flaky provider: 503s are retried with backoff and still complete
+    provider = FakeProvider(max_concurrency=8, failure_rate=0.2)
+    limiter = AdaptiveLimiter("fake:flaky", concurrency=4, max_concurrency=8,
+                              base_delay=0.02, cooldown=0.1)
+    report = await check_limiter(provider, limiter, 100)
+    print("flaky provider:", report)
+    assert report['failures'] == 0
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(check_convergence())
+    except AssertionError:
+        sys.exit("limiter did not converge.")
+    print("limiter converged.")
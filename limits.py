@@ -0,0 +1,163 @@
+from telemetry import get_metrics
+import asyncio
+import random
+import time
+
+# starting point for every limiter; `concurrency` is where AIMD starts and
+# `max_concurrency` where it stops growing. `rpm` of None disables the bucket.
+PROVIDER_LIMITS = {
+    'openai': {'rpm': 500, 'concurrency': 8, 'max_concurrency': 32},
+    'elevenlabs': {'rpm': None, 'concurrency': 3, 'max_concurrency': 10},
+    'veo': {'rpm': 10, 'concurrency': 2, 'max_concurrency': 4},
+}
+THROTTLE_STATUSES = {429, 503}
+
+_limiters = {}
+
+
+def status_of(exc: Exception):
+    for attr in ('status_code', 'code', 'status'):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def retry_after_of(exc: Exception):
+    headers = getattr(exc, 'headers', None)
+    if headers is None:
+        headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """Token bucket plus AIMD concurrency limit for one provider/model.
+
+    Every success grows the concurrency limit by 1/limit (about one slot per
+    window of successful calls); a 429/503 halves it, at most once per
+    `cooldown` seconds, and the call is retried after a jittered backoff or
+    the provider's Retry-After, which also pauses every other caller.
+    """
+
+    def __init__(self,
+                 name: str,
+                 rpm: float = None,
+                 concurrency: int = 1,
+                 max_concurrency: int = 8,
+                 min_concurrency: int = 1,
+                 max_retries: int = 6,
+                 base_delay: float = 1.0,
+                 max_delay: float = 60.0,
+                 cooldown: float = 1.0):
+        self.name = name
+        self.rpm = rpm
+        self.concurrency = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cooldown = cooldown
+
+        self.active = 0
+        self.successes = 0
+        self.throttles = 0
+        self._tokens = 1.0
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._decreased_at = 0.0
+        self._cond = asyncio.Condition()
+
+    def _refill(self, now: float):
+        if self.rpm is None:
+            return
+        rate = self.rpm / 60
+        self._tokens = min(max(1.0, rate), self._tokens + (now - self._refilled_at) * rate)
+        self._refilled_at = now
+
+    async def acquire(self):
+        async with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self.active >= int(self.concurrency):
+                    wait = None
+                elif self.rpm is not None and self._tokens < 1:
+                    wait = (1 - self._tokens) / (self.rpm / 60)
+                else:
+                    if self.rpm is not None:
+                        self._tokens -= 1
+                    self.active += 1
+                    return
+                try:
+                    await asyncio.wait_for(self._cond.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, success: bool = True, throttled: bool = False,
+                      retry_after: float = None):
+        async with self._cond:
+            self.active -= 1
+            now = time.monotonic()
+            if throttled:
+                self.throttles += 1
+                if now - self._decreased_at >= self.cooldown:
+                    self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                    self._decreased_at = now
+                if retry_after is not None:
+                    self._blocked_until = max(self._blocked_until, now + retry_after)
+            elif success:
+                self.successes += 1
+                self.concurrency = min(self.max_concurrency,
+                                       self.concurrency + 1 / self.concurrency)
+            self._cond.notify_all()
+
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.base_delay)
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    async def call(self, fn, *args, **kwargs):
+        metrics = get_metrics()
+        attempt = 0
+        while True:
+            waited = time.monotonic()
+            await self.acquire()
+            started = time.monotonic()
+            metrics.observe('limiter_wait_seconds', started - waited, limiter=self.name)
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                metrics.inc('provider_errors_total', limiter=self.name, status=status_of(e))
+                if status_of(e) not in THROTTLE_STATUSES or attempt >= self.max_retries:
+                    await self.release(success=False)
+                    raise
+                retry_after = retry_after_of(e)
+                await self.release(success=False, throttled=True, retry_after=retry_after)
+                await asyncio.sleep(self.backoff(attempt, retry_after))
+                attempt += 1
+                continue
+            except BaseException:
+                await self.release(success=False)
+                raise
+            metrics.observe('provider_latency_seconds', time.monotonic() - started, limiter=self.name)
+            await self.release()
+            return result
+
+
+def get_limiter(provider: str, model: str = None) -> AdaptiveLimiter:
+    # one limiter per provider and model for the whole process, so
+    # concurrent jobs share the provider's limits instead of multiplying them
+    key = (provider, model)
+    if key not in _limiters:
+        name = provider if model is None else f"{provider}:{model}"
+        _limiters[key] = AdaptiveLimiter(name, **PROVIDER_LIMITS.get(provider, {}))
+    return _limiters[key]
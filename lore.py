@@ -0,0 +1,123 @@
+from references import stem
+from hashlib import sha256
+from pathlib import Path
+import math
+import re
+import sys
+
+# sections kept per chunk, and the share of the best section's score
+# another one needs to be kept too
+DIGEST_SECTIONS = 4
+DIGEST_RELATIVE_SCORE = 0.4
+# matches on a heading or a named entity (`**Thalor:**`) count this much more
+ENTITY_WEIGHT = 3.0
+HEADING = re.compile(r"^\s*(?:#+\s*(.+?)\s*$|\*\*(.+?):?\*\*:?\s*$)", re.MULTILINE)
+ENTITY = re.compile(r"\*\*(.+?):?\*\*")
+STOPWORDS = set("""
+about above after again against also among around because been before being below between both
+could does doing down during each every from further have having here into itself just more most
+other over same should some such than that their them then there these they this those through
+under until very what when where which while with would your often only like many much
+""".split())
+
+_digests = {}
+
+
+def count_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English)."""
+    return math.ceil(len(text) / 4)
+
+
+def terms(text: str) -> set[str]:
+    words = re.findall(r"[a-z]+", text.lower())
+    return {stem(w) for w in words if len(w) > 3 and w not in STOPWORDS}
+
+
+def sections(text: str) -> list[tuple[str, str]]:
+    """Split the lore into (heading, text) at markdown and bold headings."""
+    starts = [m.start() for m in HEADING.finditer(text)]
+    if not starts or starts[0] > 0 and text[:starts[0]].strip():
+        starts = [0] + starts
+    result = []
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        body = text[start:end].strip()
+        if not body:
+            continue
+        match = HEADING.match(body)
+        heading = next(g for g in match.groups() if g) if match else ""
+        result.append((heading, body))
+    return result
+
+
+class LoreDigest:
+    """Picks the sections of the lore context a piece of script is about.
+
+    Each section is scored by the script's words it contains, weighted by
+    how few sections share them, with headings and named entities counting
+    ENTITY_WEIGHT times. Sections scoring within DIGEST_RELATIVE_SCORE of
+    the best are kept, along with the section introducing each proper noun
+    the script mentions, in their original order; a script that mentions
+    nothing in the lore gets the first section.
+    """
+
+    def __init__(self, text: str, max_sections: int = DIGEST_SECTIONS,
+                 relative_score: float = DIGEST_RELATIVE_SCORE):
+        self.text = text
+        self.max_sections = max_sections
+        self.relative_score = relative_score
+        self.sections = sections(text)
+        self.terms = [terms(body) for _, body in self.sections]
+        self.entities = [terms(heading + " " + " ".join(ENTITY.findall(body)))
+                         for heading, body in self.sections]
+        # a proper noun (capitalised mid-sentence, never in lower case) is
+        # pinned to the section introducing it, such as the species or planet
+        lower = set(re.findall(r"\b[a-z]+\b", text))
+        prose = HEADING.sub("", ENTITY.sub("", text))
+        names = terms(" ".join(w for w in re.findall(r"(?<=[a-z,;] )[A-Z][a-z]+", prose) if w.lower() not in lower))
+        self.introduced = {name: next(i for i, section_terms in enumerate(self.terms) if name in section_terms)
+                           for name in names}
+        frequency = {}
+        for section_terms in self.terms:
+            for term in section_terms:
+                frequency[term] = frequency.get(term, 0) + 1
+        n = len(self.sections)
+        self.weights = {term: math.log(1 + n / df) for term, df in frequency.items()}
+
+    def scores(self, script: str) -> list[float]:
+        wanted = terms(script)
+        return [sum(self.weights[t] * (ENTITY_WEIGHT if t in entities else 1.0)
+                    for t in wanted & section_terms)
+                for section_terms, entities in zip(self.terms, self.entities)]
+
+    def select(self, script: str) -> str:
+        if not self.sections:
+            return self.text
+        scores = self.scores(script)
+        best = max(scores)
+        if best == 0:
+            return self.sections[0][1]
+        kept = {self.introduced[t] for t in terms(script) if t in self.introduced}
+        for i in sorted(range(len(scores)), key=lambda i: -scores[i]):
+            if len(kept) >= self.max_sections or scores[i] < best * self.relative_score:
+                break
+            kept.add(i)
+        return "\n\n".join(self.sections[i][1] for i in sorted(kept))
+
+
+def get_lore_digest(text: str) -> LoreDigest:
+    key = sha256(text.encode()).hexdigest()
+    if key not in _digests:
+        _digests[key] = LoreDigest(text)
+    return _digests[key]
+
+
+if __name__ == "__main__":
+    # python lore.py context.txt "a piece of script"
+    digest = LoreDigest(Path(sys.argv[1]).read_text())
+    if len(sys.argv) > 2:
+        selected = digest.select(sys.argv[2])
+        print(selected)
+        print(f"\n{count_tokens(digest.text)} -> {count_tokens(selected)} tokens")
+    else:
+        for heading, body in digest.sections:
+            print(f"{heading or '(preamble)'}: {count_tokens(body)} tokens")
@@ -1,159 +1,732 @@
-from openai_agent import WriterAgent, ChunkerAgent, VeoPrompter
+from openai_agent import WriterAgent, ChunkerAgent, VeoPrompter, TranslatorAgent
 from elevenlabs_agents import VoiceGenerationAgent
 from video_generation import VideoGenerationAgent
-from utils import Cacher, generate_hash, get_references
+from utils import Cacher, generate_hash
+from prompts import get_prompt_registry
+from lore import count_tokens, get_lore_digest
+from store import ArtifactStore, stage_key
+from clients import close_clients
+from audio import AudioArtifact
+from assembly import assemble_short
+from clip_index import get_clip_index
+from chunking import split_stream
+from references import ReferenceLibrary, get_reference_library
+from telemetry import get_metrics
 import asyncio
+import logging
 from pathlib import Path
-from collections import defaultdict
 
-ELEVENLABS_SEMAPHORE = 3
-VEO_SEMAPHORE = 2
-SAVE_DIR = Path("./.cache/20251023110303_safe")
+SAVE_DIR = None
+# least recently used artifacts are evicted above this; workers run without
+# a budget (see worker.py)
+STORE_MAX_BYTES = 20 * 1024 ** 3
 OPENAI_MODEL = 'gpt-4.1'
 VECTOR_STORE_ID = "vs_68f01ec9d8a08191b2ace026d2cf8a80"
+# "local" serves RAG from a snapshot synced with `python rag_cache.py sync`
+RETRIEVAL_MODE = "remote"
 VOICE_ID = "nrbjbLmJZ7T1FcsFbbeE"
 ELEVENLABS_MODEL = "eleven_multilingual_v2"
 VOICE_SPEED = 1.1
+# voice neighbouring chunks together in requests of up to this many
+# characters, split back using character timestamps; None voices each
+# chunk on its own
+VOICE_BATCH_CHARS = None
+# True trims narration of silence, normalises it to NARRATION_LUFS and
+# follows it with NARRATION_GAP_MS of silence before clips are planned from
+# its length (needs ffmpeg); False keeps the provider's audio as it is
+PROCESS_AUDIO = True
+NARRATION_LUFS = -16.0
+NARRATION_GAP_MS = 250
 ASPECT_RATIO = "9:16"
 VIDEO_DURATION = "8"
+VEO_MODELS = VideoGenerationAgent.MODEL_NAMES
+# seconds before a clip still pending on veo-3.0 is also submitted to the
+# fast model; None disables hedging
+VEO_HEDGE_AFTER = None
+REFERENCES_DIR = Path("references")
+# reference images attached to each clip, picked by the description, when it
+# is submitted to a model that accepts them (veo-2.0); 0 attaches none
+MAX_REFERENCES = 3
+# cut the clips to the narration and write short.mp4 (needs ffmpeg); off until
+# it has been checked against real Veo output
+ASSEMBLE = False
+# stream the writer's output and chunk it locally, so narration starts while
+# the script is still being written; False writes it whole and uses ChunkerAgent
+STREAM_SCRIPT = False
+# the language the script is written in; the other languages of VARIANTS
+# are translated from it
+SCRIPT_LANGUAGE = "English"
+# languages and formats to publish the short in, as dicts with `language`,
+# `aspect_ratio` and optionally `voice_id`, e.g.
+# [{'language': "English", 'aspect_ratio': "9:16"},
+#  {'language': "Italian", 'aspect_ratio': "16:9", 'voice_id': "..."}];
+# None makes the single short set up above
+VARIANTS = None
+# descriptions at least this similar to a clip of another job reuse it
+# instead of generating a new one; None turns semantic reuse off. VeoPrompter
+# repeats subject and setting text across prompts, so different shots can
+# score close to 0.7: tune this on real descriptions before turning it on
+CLIP_REUSE_THRESHOLD = None
 
+# clips being generated, by video key
+_generating = {}
 
-async def process_script(query):
-    writer = WriterAgent('Writer', OPENAI_MODEL,
-                         vector_store_id=VECTOR_STORE_ID)
+
+def agent_name(name, job_id=None):
+    return name if job_id is None else f"{job_id}.{name}"
+
+
+def script_key(query):
+    return stage_key('script', query=query, model=OPENAI_MODEL,
+                     vector_store_id=VECTOR_STORE_ID,
+                     prompt=get_prompt_registry().hash('WriterAgent'))
+
+
+def chunks_key(script):
+    return stage_key('chunks', script=script, model=OPENAI_MODEL,
+                     prompt=get_prompt_registry().hash('ChunkerAgent'))
+
+
+def audio_key(chunk, voice_id=None):
+    return stage_key('audio', text=chunk, model=ELEVENLABS_MODEL,
+                     voice_id=voice_id or VOICE_ID, settings={'speed': VOICE_SPEED})
+
+
+def narration_key(chunk, voice_id=None):
+    # the audio the rest of the pipeline uses for `chunk`
+    if not PROCESS_AUDIO:
+        return audio_key(chunk, voice_id)
+    return stage_key('narration', audio=audio_key(chunk, voice_id), lufs=NARRATION_LUFS,
+                     gap_ms=NARRATION_GAP_MS)
+
+
+def translation_key(chunk, language):
+    return stage_key('translation', text=chunk, language=language, model=OPENAI_MODEL,
+                     prompt=get_prompt_registry().hash('TranslatorAgent'))
+
+
+def descriptions_key(chunk, versions, context):
+    return stage_key('descriptions', script=chunk, versions=versions,
+                     context=context, model=OPENAI_MODEL,
+                     prompt=get_prompt_registry().hash('VeoPrompter'))
+
+
+def video_variant(aspect_ratio=None, references=()):
+    # clips are only reused among ones made with the same reference images,
+    # named after the hash of their content
+    variant = f"{aspect_ratio or ASPECT_RATIO}_{VIDEO_DURATION}"
+    return "_".join([variant] + sorted(Path(p).stem for p in references))
+
+
+def video_key(desc, references=(), aspect_ratio=None):
+    # clips without references keep the keys they had before references existed
+    extra = {'references': [Path(p).stem for p in references]} if references else {}
+    return stage_key('video', prompt=desc, models=VEO_MODELS,
+                     aspect_ratio=aspect_ratio or ASPECT_RATIO, duration=VIDEO_DURATION, **extra)
+
+
+def select_references(library, desc):
+    if library is None or not MAX_REFERENCES:
+        return []
+    return library.select(desc, MAX_REFERENCES)
+
+
+async def process_script(query, store=None, job_id=None):
+    key = script_key(query)
+    if store is not None:
+        script = store.get_json('script', key)
+        if script is not None:
+            return script
+
+    writer = WriterAgent(agent_name('Writer', job_id), OPENAI_MODEL,
+                         vector_store_id=VECTOR_STORE_ID,
+                         retrieval=RETRIEVAL_MODE)
     script = await writer.run(query=query)
+    if store is not None:
+        store.put_json('script', key, script)
     return script
 
 
-async def process_chunks(script):
-    chunker = ChunkerAgent('Chunker', OPENAI_MODEL)
+async def stream_script(query, store=None, job_id=None):
+    key = script_key(query)
+    if store is not None:
+        script = store.get_json('script', key)
+        if script is not None:
+            yield script
+            return
+
+    writer = WriterAgent(agent_name('Writer', job_id), OPENAI_MODEL,
+                         vector_store_id=VECTOR_STORE_ID,
+                         retrieval=RETRIEVAL_MODE)
+    parts = []
+    async for delta in writer.stream(query):
+        parts.append(delta)
+        yield delta
+    if store is not None:
+        store.put_json('script', key, "".join(parts))
+
+
+async def process_chunks(script, store=None, job_id=None, previous=None):
+    """Split `script` into chunks.
+
+    With the `previous` chunks of an earlier version of the script, chunks
+    still found verbatim and in order are kept as they are and only the text
+    around them is sent to the chunker, so the artifacts of unchanged chunks
+    stay valid.
+    """
+    if previous:
+        chunks = []
+        for text, unchanged in split_changed(previous, script):
+            if unchanged:
+                chunks.append(text)
+            else:
+                chunks.extend(await process_chunks(text, store, job_id))
+        return chunks
+
+    key = chunks_key(script)
+    if store is not None:
+        chunks = store.get_json('chunks', key)
+        if chunks is not None:
+            return chunks
+
+    chunker = ChunkerAgent(agent_name('Chunker', job_id), OPENAI_MODEL)
     chunks_model = await chunker.run(script=script)
     chunks = chunks_model.model_dump()['descriptions']
+    if store is not None:
+        store.put_json('chunks', key, chunks)
 
     return chunks
 
 
-async def process_voice(chunks, cacher=None):
-    chunks_l = len(chunks)
-    semaphore = asyncio.Semaphore(ELEVENLABS_SEMAPHORE)
-    audio_agents = [VoiceGenerationAgent(f"AudioGeneration_{i}",
-                                         voice_id=VOICE_ID,
-                                         model=ELEVENLABS_MODEL,
-                                         semaphore=semaphore,
-                                         settings={'speed': VOICE_SPEED})
-                    for i in range(chunks_l)]
+def split_changed(chunks, script):
+    """Pieces of `script` as (text, unchanged), `chunks` being the old ones.
 
-    async def download_and_save_audio(agent, chunk):
+    Old chunks that border new text are chunked again along with it, as an
+    edit at the edge of a chunk may belong to it.
+    """
+    spans = []
+    pos = 0
+    for chunk in chunks:
+        at = script.find(chunk, pos)
+        if at == -1:
+            continue
+        if script[pos:at].strip():
+            spans.append([pos, at, False])
+        spans.append([at, at + len(chunk), True])
+        pos = at + len(chunk)
+    if script[pos:].strip():
+        spans.append([pos, len(script), False])
+
+    edited = [not unchanged for _, _, unchanged in spans]
+    for i, span in enumerate(spans):
+        if (i > 0 and edited[i - 1]) or (i + 1 < len(spans) and edited[i + 1]):
+            span[2] = False
+
+    pieces = []
+    for start, end, unchanged in spans:
+        if not unchanged and pieces and not pieces[-1][2]:
+            pieces[-1][1] = end
+        else:
+            pieces.append([start, end, unchanged])
+    return [(script[start:end].strip(), unchanged) for start, end, unchanged in pieces]
+
+
+def video_name(chunk, desc):
+    return f"{generate_hash(chunk)}_{generate_hash(desc)}"
+
+
+def count_versions(audio):
+    length = len(audio) / 1000
+    return int(length // 8) if length % 8 < 4 else int(length // 8) + 1
+
+
+def stored_audio(chunk, store=None, kind='audio', voice_id=None):
+    if store is None:
+        return None
+    key = audio_key(chunk, voice_id) if kind == 'audio' else narration_key(chunk, voice_id)
+    path = store.get(kind, key, 'mp3')
+    return None if path is None else AudioArtifact(path=path)
+
+
+async def voice_chunk(agent, chunk, store=None):
+    audio = stored_audio(chunk, store, voice_id=agent.voice_id)
+    if audio is None:
         audio = await agent.run(chunk)
-        audio_hash = generate_hash(chunk)
-        if cacher:
-            cacher.save_audio({audio_hash: audio})
-        return audio_hash, audio
+        if store is not None:
+            path = store.put('audio', audio_key(chunk, agent.voice_id), 'mp3', audio.data)
+            audio = AudioArtifact(path=path, duration_ms=audio.duration_ms)
+    return audio
 
-    results = await asyncio.gather(*[download_and_save_audio(audio_agents[i], chunks[i])
-                                     for i in range(chunks_l)])
-    audios = {audio_hash: audio for audio_hash, audio in results}
 
+async def finish_audio(raw, store=None, voice_id=None):
+    """Post-process the provider's audio of the chunks in `raw` (see narration.py).
+
+    The chunks of one voice pack are processed together; otherwise each
+    chunk is processed as soon as it is voiced.
+    """
+    if not PROCESS_AUDIO or not raw:
+        return raw
+    # imported here, so that a run served from caches doesn't load NumPy
+    from narration import process_narration
+    chunks = list(raw)
+    with get_metrics().span('narration', attrs={'chunks': len(chunks)}):
+        processed = await process_narration([raw[chunk] for chunk in chunks], NARRATION_LUFS, NARRATION_GAP_MS)
+    audios = {}
+    for chunk, audio in zip(chunks, processed):
+        if store is not None:
+            path = store.put('narration', narration_key(chunk, voice_id), 'mp3', audio.data)
+            audio = AudioArtifact(path=path, duration_ms=audio.duration_ms)
+        audios[chunk] = audio
     return audios
 
 
-async def process_veo_prompts(chunks, audios, context=None):
-    chunks_l = len(chunks)
-    veo_prompters = [VeoPrompter(
-        f'Prompter_{i}', OPENAI_MODEL) for i in range(chunks_l)]
-    lengths = [len(audios[generate_hash(chunk)]) / 1000 for chunk in chunks]
-    n_descriptions = [int(l // 8) if l %
-                      8 < 4 else int(l // 8) + 1 for l in lengths]
-    result = await asyncio.gather(*[veo_prompters[i].run(chunks[i], n_descriptions[i], context)
-                                    for i in range(chunks_l)])
+async def generate_audio(agent, chunk, cacher=None, store=None):
+    audio_hash = generate_hash(chunk)
+    audio = stored_audio(chunk, store, 'narration', agent.voice_id) if PROCESS_AUDIO else None
+    if audio is None:
+        raw = await voice_chunk(agent, chunk, store)
+        audio = (await finish_audio({chunk: raw}, store, agent.voice_id))[chunk]
+    if cacher and audio.path is not None:
+        cacher.save_audio({audio_hash: audio})
+    return audio_hash, audio
+
+
+def pack_chunks(chunks, budget, skip=()):
+    """Runs of neighbouring chunks, not in `skip`, of up to `budget` characters."""
+    packs = [[]]
+    for chunk in chunks:
+        if chunk in skip:
+            packs.append([])
+            continue
+        if packs[-1] and sum(len(c) + 1 for c in packs[-1]) + len(chunk) > budget:
+            packs.append([])
+        packs[-1].append(chunk)
+    return [pack for pack in packs if pack]
+
+
+async def generate_audio_pack(agent, chunks, cacher=None, store=None):
+    """Audio for each of `chunks`, voicing the ones not in the store together."""
+    audios = {}
+    raw = {}
+    missing = []
+    for chunk in chunks:
+        audio = stored_audio(chunk, store, 'narration', agent.voice_id) if PROCESS_AUDIO else None
+        if audio is not None:
+            audios[chunk] = audio
+            continue
+        audio = stored_audio(chunk, store, voice_id=agent.voice_id)
+        if audio is None:
+            missing.append(chunk)
+        else:
+            raw[chunk] = audio
+
+    if len(missing) == 1:
+        raw[missing[0]] = await voice_chunk(agent, missing[0], store)
+    elif missing:
+        for chunk, audio in zip(missing, await agent.run_coalesced(missing)):
+            if store is not None:
+                path = store.put('audio', audio_key(chunk, agent.voice_id), 'mp3', audio.data)
+                audio = AudioArtifact(path=path, duration_ms=audio.duration_ms)
+            raw[chunk] = audio
+    audios.update(await finish_audio(raw, store, agent.voice_id))
+
+    if cacher:
+        cacher.save_audio({generate_hash(chunk): audio for chunk, audio in audios.items()
+                           if audio.path is not None})
+    return {generate_hash(chunk): audios[chunk] for chunk in chunks}
+
+
+def chunk_context(chunk, context):
+    # only the lore the chunk is about goes to VeoPrompter and into every
+    # description of its clips
+    return None if context is None else get_lore_digest(context).select(chunk)
+
+
+async def generate_descriptions(prompter, chunk, audio, context=None, store=None, cacher=None):
+    versions = count_versions(audio)
+    lore, context = context, chunk_context(chunk, context)
+    key = descriptions_key(chunk, versions, context)
+    descs = cacher.restore_descriptions(chunk, key) if cacher else None
+    if descs is not None:
+        return descs
+    if store is not None:
+        descs = store.get_json('descriptions', key)
+    if descs is None:
+        if context is not None:
+            get_metrics().inc('context_tokens_total', count_tokens(lore), kind='full')
+            get_metrics().inc('context_tokens_total', count_tokens(context), kind='digest')
+        result = await prompter.run(chunk, versions, context)
+        descs = result.model_dump()['descriptions']
+        if store is not None:
+            store.put_json('descriptions', key, descs)
+    if cacher:
+        cacher.save_descriptions(chunk, descs, key)
+    return descs
+
+
+async def make_clip(agent, desc, key, aspect_ratio=None, store=None, job_id=None):
+    dest = store.temp_path('video', 'mp4') if store is not None else None
+    path = await agent.run(desc, key=key, dest=dest)
+    if store is not None:
+        path = store.put_file('video', key, 'mp4', path)
+        get_clip_index().add(key, desc, video_variant(aspect_ratio, agent.references), job_id)
+    return path
+
+
+async def generate_video(agent, chunk, desc, cacher=None, store=None, job_id=None):
+    name = video_name(chunk, desc)
+    aspect_ratio = agent.settings.get('aspectRatio')
+    key = video_key(desc, agent.references, aspect_ratio)
+    path = store.get('video', key, 'mp4') if store is not None else None
+    if path is None and store is not None and CLIP_REUSE_THRESHOLD is not None:
+        index = get_clip_index()
+        match, score = index.find(desc, video_variant(aspect_ratio, agent.references), CLIP_REUSE_THRESHOLD,
+                                  exclude_job=job_id)
+        if match is not None:
+            path = store.get('video', match, 'mp4')
+            if path is None:
+                index.remove(match)
+            else:
+                agent.log(f"reusing clip {match} ({score:.2f} similar).", logging.INFO)
+    if path is None:
+        # a clip already being made for another chunk or run is waited for
+        if key not in _generating:
+            _generating[key] = asyncio.ensure_future(make_clip(agent, desc, key, aspect_ratio, store, job_id))
+            _generating[key].add_done_callback(lambda _: _generating.pop(key, None))
+        path = await asyncio.shield(_generating[key])
+        if store is not None:
+            store.pin(path)
+    if cacher:
+        cacher.save_videos({name: path}, {name: key})
+    return name, path
+
+
+def make_voice_agent(name, voice_id=None):
+    return VoiceGenerationAgent(name,
+                                voice_id=voice_id or VOICE_ID,
+                                model=ELEVENLABS_MODEL,
+                                settings={'speed': VOICE_SPEED})
 
+
+def make_prompter(name):
+    return VeoPrompter(name, OPENAI_MODEL)
+
+
+def make_translator(name):
+    return TranslatorAgent(name, OPENAI_MODEL)
+
+
+def make_video_agent(name, store=None, references=[], aspect_ratio=None):
+    return VideoGenerationAgent(name,
+                                references=references,
+                                store=store,
+                                settings={"aspectRatio": aspect_ratio or ASPECT_RATIO,
+                                          "durationSeconds": VIDEO_DURATION},
+                                hedge_after=VEO_HEDGE_AFTER)
+
+
+async def process_pipeline(chunks, audios, descriptions, videos,
+                           context=None, references: ReferenceLibrary = None, cacher=None, store=None,
+                           job_id=None):
+    """Run voice, prompting and video generation as a per-chunk dataflow.
+
+    Each chunk moves on to its VeoPrompter as soon as its own audio lands, and
+    its descriptions are queued for Veo straight away, so no stage waits for
+    the slowest item of the previous one. `audios` and `videos` hold whatever
+    was restored and are filled in place, as is `descriptions`; descriptions
+    are checked against their inputs per chunk, so only chunks whose text,
+    duration or context changed reach the VeoPrompter. With
+    `VOICE_BATCH_CHARS`, chunks wait for the pack they are voiced in.
+    """
+    metrics = get_metrics()
+    packs = {}
+
+    async def process_pack(n, pack):
+        agent = make_voice_agent(agent_name(f"AudioGeneration_pack_{n}", job_id))
+        with metrics.span('stage', attrs={'job': job_id, 'pack': n, 'chunks': len(pack)}, stage='voice'):
+            audios.update(await generate_audio_pack(agent, pack, cacher, store))
+
+    async def process_chunk(i, chunk):
+        audio_hash = generate_hash(chunk)
+        if chunk in packs:
+            await packs[chunk]
+        if audio_hash not in audios:
+            agent = make_voice_agent(agent_name(f"AudioGeneration_{i}", job_id))
+            with metrics.span('stage', attrs={'job': job_id, 'chunk': i}, stage='voice'):
+                _, audios[audio_hash] = await generate_audio(agent, chunk, cacher, store)
+
+        if chunk not in descriptions:
+            prompter = make_prompter(agent_name(f'Prompter_{i}', job_id))
+            with metrics.span('stage', attrs={'job': job_id, 'chunk': i}, stage='prompt'):
+                descriptions[chunk] = await generate_descriptions(prompter, chunk, audios[audio_hash],
+                                                                  context, store, cacher)
+
+        async def process_desc(j, desc):
+            name = video_name(chunk, desc)
+            selected = select_references(references, desc)
+            # clips restored from a run with other video settings are made again
+            if name in videos and (cacher is None or cacher.current('video', name, video_key(desc, selected))):
+                return
+            agent = make_video_agent(agent_name(f"VideoGeneration_{i}_{j}", job_id), store, selected)
+            with metrics.span('stage', attrs={'job': job_id, 'chunk': i, 'clip': j}, stage='video'):
+                _, videos[name] = await generate_video(agent, chunk, desc, cacher, store, job_id)
+
+        await asyncio.gather(*[process_desc(j, desc)
+                               for j, desc in enumerate(descriptions[chunk])])
+
+    # `chunks` may also be an async iterator, for chunks still being written
+    tasks = []
+    try:
+        if hasattr(chunks, '__aiter__'):
+            # chunks still being streamed are voiced one by one, as waiting
+            # for neighbours would hold up the first audio
+            async for chunk in chunks:
+                tasks.append(asyncio.create_task(process_chunk(len(tasks), chunk)))
+        else:
+            if VOICE_BATCH_CHARS:
+                done = {c for c in chunks if generate_hash(c) in audios}
+                for n, pack in enumerate(pack_chunks(chunks, VOICE_BATCH_CHARS, done)):
+                    task = asyncio.create_task(process_pack(n, pack))
+                    tasks.append(task)
+                    packs.update({chunk: task for chunk in pack})
+            tasks += [asyncio.create_task(process_chunk(i, chunk))
+                      for i, chunk in enumerate(chunks)]
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return audios, descriptions, videos
+
+
+async def process_streamed_script(query, audios, videos, context=None, references: ReferenceLibrary = None,
+                                  cacher=None, store=None, job_id=None):
+    """Write the script and run the pipeline on each chunk as soon as it is settled."""
+    metrics = get_metrics()
+    deltas = []
+    chunks = []
+
+    async def written():
+        with metrics.span('stage', attrs={'job': job_id}, stage='script'):
+            async for delta in stream_script(query, store, job_id):
+                deltas.append(delta)
+                yield delta
+
+    async def chunked():
+        async for chunk in split_stream(written()):
+            chunks.append(chunk)
+            yield chunk
+
+    audios, descriptions, videos = await process_pipeline(chunked(), audios, {}, videos, context,
+                                                          references, cacher, store, job_id)
+    script = "".join(deltas)
+    if cacher:
+        cacher.save_script(script)
+        cacher.save_chunks(chunks, generate_hash(script))
+    return script, chunks, audios, descriptions, videos
+
+
+def variant_name(variant):
+    name = f"{variant['language']}_{variant['aspect_ratio']}"
+    if variant.get('voice_id'):
+        name += f"_{variant['voice_id']}"
+    return name.lower().replace(":", "x").replace(" ", "_")
+
+
+async def translate_chunk(agent, chunk, language, store=None):
+    if language == SCRIPT_LANGUAGE:
+        return chunk
+    key = translation_key(chunk, language)
+    text = store.get_json('translation', key) if store is not None else None
+    if text is None:
+        text = await agent.run(chunk, language)
+        if store is not None:
+            store.put_json('translation', key, text)
+    return text
+
+
+async def process_variants(chunks, variants, context=None, references: ReferenceLibrary = None,
+                           cacher=None, store=None, job_id=None):
+    """Narration and clips for several languages and formats of one script.
+
+    Descriptions are planned from the narration in SCRIPT_LANGUAGE and are
+    shared by every variant, as are the clips of each aspect ratio, so the
+    other languages only add a translation and a narration per chunk, made
+    alongside the clips. Assembly fits the clips to each narration's length.
+    Returns the narration per (language, voice id), keyed by chunk hash,
+    the descriptions, and the clips per aspect ratio.
+    """
+    metrics = get_metrics()
+    source = (SCRIPT_LANGUAGE, VOICE_ID)
+    voices = list(dict.fromkeys((v['language'], v.get('voice_id') or VOICE_ID) for v in variants))
+    aspect_ratios = list(dict.fromkeys(v['aspect_ratio'] for v in variants))
+    narrations = {voice: {} for voice in [source] + voices}
     descriptions = {}
-    for i, r in enumerate(result):
-        descriptions[chunks[i]] = r.model_dump()['descriptions']
+    videos = {aspect_ratio: {} for aspect_ratio in aspect_ratios}
 
-    return descriptions
+    async def process_chunk(i, chunk):
+        agent = make_voice_agent(agent_name(f"AudioGeneration_{i}", job_id))
+        with metrics.span('stage', attrs={'job': job_id, 'chunk': i}, stage='voice'):
+            audio_hash, audio = await generate_audio(agent, chunk, cacher, store)
+        narrations[source][audio_hash] = audio
 
+        prompter = make_prompter(agent_name(f'Prompter_{i}', job_id))
+        with metrics.span('stage', attrs={'job': job_id, 'chunk': i}, stage='prompt'):
+            descriptions[chunk] = await generate_descriptions(prompter, chunk, audio, context, store, cacher)
 
-async def process_video(descriptions, references: list = [], cacher=None):
-    video_semaphore = asyncio.Semaphore(VEO_SEMAPHORE)
-    descriptions_flat = []
-    video_names = []
-    for chunk, descs in descriptions.items():
-        chunk_hash = generate_hash(chunk)
-        for desc in descs:
-            desc_hash = generate_hash(desc)
-            video_names.append(f"{chunk_hash}_{desc_hash}")
-            descriptions_flat.append(desc)
+        async def process_clip(j, desc, aspect_ratio):
+            agent = make_video_agent(agent_name(f"VideoGeneration_{i}_{j}_{aspect_ratio}", job_id), store,
+                                     select_references(references, desc), aspect_ratio)
+            with metrics.span('stage', attrs={'job': job_id, 'chunk': i, 'clip': j}, stage='video'):
+                # clip names are the same in every format, so each variant records its own
+                name, path = await generate_video(agent, chunk, desc, None, store, job_id)
+            videos[aspect_ratio][name] = path
 
-    video_agents = [VideoGenerationAgent(f"VideoGeneration_{i}",
-                                         semaphore=video_semaphore,
-                                         settings={"aspectRatio": ASPECT_RATIO,
-                                                   "durationSeconds": VIDEO_DURATION})
-                    for i in range(len(descriptions_flat))]
+        await asyncio.gather(*[process_clip(j, desc, aspect_ratio)
+                               for j, desc in enumerate(descriptions[chunk])
+                               for aspect_ratio in aspect_ratios])
 
-    async def download_and_save_video(agent, desc, video_name):
-        video = await agent.run(desc)
-        if cacher:
-            cacher.save_videos({video_name: video})
-        return video_name, video
+    async def process_translation(i, chunk, language, voice_id):
+        translator = make_translator(agent_name(f"Translator_{i}_{language}", job_id))
+        with metrics.span('stage', attrs={'job': job_id, 'chunk': i, 'language': language}, stage='translation'):
+            text = await translate_chunk(translator, chunk, language, store)
+        agent = make_voice_agent(agent_name(f"AudioGeneration_{i}_{language}", job_id), voice_id)
+        with metrics.span('stage', attrs={'job': job_id, 'chunk': i, 'language': language}, stage='voice'):
+            _, audio = await generate_audio(agent, text, None, store)
+        narrations[(language, voice_id)][generate_hash(chunk)] = audio
 
-    results = await asyncio.gather(*[download_and_save_video(video_agents[i], descriptions_flat[i], video_names[i])
-                                     for i in range(len(descriptions_flat))])
-    videos = {video_name: video for video_name, video in results}
+    await asyncio.gather(*[process_chunk(i, chunk) for i, chunk in enumerate(chunks)],
+                         *[process_translation(i, chunk, language, voice_id)
+                           for language, voice_id in voices if (language, voice_id) != source
+                           for i, chunk in enumerate(chunks)])
+    return narrations, descriptions, videos
 
-    return videos
 
+async def process_assembly(chunks, audios, descriptions, videos, output):
+    segments = []
+    for chunk in chunks:
+        clips = [videos[video_name(chunk, desc)] for desc in descriptions[chunk]]
+        segments.append((audios[generate_hash(chunk)], clips))
+    return await assemble_short(segments, output)
 
-async def main():
-    cacher = Cacher(save_dir=SAVE_DIR)
-    script, chunks, audios, descriptions, videos = cacher.restore()
-    query = 'Write a script about the Ortheans'
 
+def read_context(path="./context.txt"):
+    context_path = Path(path)
+    if not context_path.exists():
+        return None
+    return context_path.read_text()
+
+
+async def prepare_chunks(query, script=None, chunks=None, cacher=None, store=None, job_id=None):
+    metrics = get_metrics()
     if script is None:
-        script = await process_script(query)
+        with metrics.span('stage', attrs={'job': job_id}, stage='script'):
+            script = await process_script(query, store, job_id)
         cacher.save_script(script)
 
-    if chunks is None:
-        chunks = await process_chunks(script)
-        cacher.save_chunks(chunks)
-
-    if audios is None:
-        audios = await process_voice(chunks, cacher)
-    else:
-        # calculate how many audios we are missing
-        remaining_chunks = []
-        for chunk in chunks:
-            name = generate_hash(chunk)
-            if name not in audios:
-                remaining_chunks.append(chunk)
-        if remaining_chunks:
-            remaining_audios = await process_voice(remaining_chunks, cacher)
-            audios.update(remaining_audios)
-
-    if descriptions is None:
-        context = None
-        context_path = Path("./context.txt")
-        if context_path.exists():
-            context = context_path.read_text()
-        descriptions = await process_veo_prompts(chunks, audios, context)
-        cacher.save_descriptions(descriptions)
-
-    # implement retrieval
-    references = get_references("./references")
-    if videos is None:
-        videos = await process_video(descriptions, references, cacher)
-    else:
-        # calculate how many audios we are missing
-        remaining_descriptions = defaultdict(list)
-        for chunk, descs in descriptions.items():
-            chunk_hash = generate_hash(chunk)
-            for desc in descs:
-                desc_hash = generate_hash(desc)
-                name = f"{chunk_hash}_{desc_hash}"
-                if name not in videos:
-                    remaining_descriptions[chunk].append(desc)
-        if remaining_descriptions:
-            remaining_videos = await process_video(remaining_descriptions, references, cacher)
-            videos.update(remaining_videos)
-
-asyncio.run(main())
+    # chunks made from an earlier version of the script are updated in place
+    if chunks is None or not cacher.current('chunks', 'chunks', generate_hash(script)):
+        with metrics.span('stage', attrs={'job': job_id}, stage='chunks'):
+            chunks = await process_chunks(script, store, job_id, previous=chunks)
+        cacher.save_chunks(chunks, generate_hash(script))
+    return script, chunks
+
+
+async def run_job(query, job_id=None, store=None, save_dir=None):
+    if job_id is None:
+        job_id = generate_hash(query)
+    if store is None:
+        store = ArtifactStore(max_bytes=STORE_MAX_BYTES)
+    cacher = Cacher(save_dir=save_dir, run_id=job_id)
+    metrics = get_metrics()
+
+    context = read_context()
+
+    references = get_reference_library(REFERENCES_DIR)
+
+    with store.pinned():
+        script, chunks, audios, videos = cacher.restore()
+        # the run refers to its audio and clips in the store, so they are
+        # kept there until it is assembled
+        for path in [audio.path for audio in (audios or {}).values()] + list((videos or {}).values()):
+            store.pin(path)
+
+        if script is None and STREAM_SCRIPT:
+            script, chunks, audios, descriptions, videos = await process_streamed_script(
+                query, audios or {}, videos or {}, context, references, cacher, store, job_id)
+        else:
+            script, chunks = await prepare_chunks(query, script, chunks, cacher, store, job_id)
+
+            # audio restored from a run with other narration settings is made again
+            keys = {generate_hash(chunk): narration_key(chunk) for chunk in chunks}
+            audios = {audio_hash: audio for audio_hash, audio in (audios or {}).items()
+                      if cacher.current('audio', audio_hash, keys.get(audio_hash))}
+
+            audios, descriptions, videos = await process_pipeline(chunks, audios, {}, videos or {},
+                                                                  context, references, cacher, store, job_id)
+
+        if ASSEMBLE:
+            with metrics.span('stage', attrs={'job': job_id}, stage='assembly'):
+                await process_assembly(chunks, audios, descriptions, videos, cacher.save_dir / "short.mp4")
+
+    return cacher.save_dir
+
+
+async def run_variants(query, variants, job_id=None, store=None, save_dir=None):
+    """Run a job once for several languages and formats (see `process_variants`).
+
+    The script, chunks, descriptions and source narration are kept in the
+    job's run directory as usual; each variant gets a directory of its own
+    under `variants/`, with its narration, its clips and its short.
+    """
+    names = [variant_name(variant) for variant in variants]
+    if len(set(names)) < len(names):
+        # they would write to the same directory
+        raise ValueError(f"duplicate variants: {sorted(n for n in set(names) if names.count(n) > 1)}.")
+    if job_id is None:
+        job_id = generate_hash(query)
+    if store is None:
+        store = ArtifactStore(max_bytes=STORE_MAX_BYTES)
+    cacher = Cacher(save_dir=save_dir, run_id=job_id)
+    script, chunks, _, _ = cacher.restore()
+    metrics = get_metrics()
+
+    context = read_context()
+    references = get_reference_library(REFERENCES_DIR)
+
+    async def finish(variant):
+        voice = (variant['language'], variant.get('voice_id') or VOICE_ID)
+        variant_dir = cacher.save_dir / "variants" / variant_name(variant)
+        variant_dir.mkdir(parents=True, exist_ok=True)
+        variant_cacher = Cacher(save_dir=variant_dir)
+        variant_cacher.save_audio({audio_hash: audio for audio_hash, audio in narrations[voice].items()
+                                   if audio.path is not None})
+        variant_cacher.save_videos(videos[variant['aspect_ratio']])
+        if ASSEMBLE:
+            with metrics.span('stage', attrs={'job': job_id, 'variant': variant_name(variant)}, stage='assembly'):
+                await process_assembly(chunks, narrations[voice], descriptions, videos[variant['aspect_ratio']],
+                                       variant_dir / "short.mp4")
+
+    with store.pinned():
+        script, chunks = await prepare_chunks(query, script, chunks, cacher, store, job_id)
+        narrations, descriptions, videos = await process_variants(chunks, variants, context, references,
+                                                                  cacher, store, job_id)
+        await asyncio.gather(*[finish(variant) for variant in variants])
+    return cacher.save_dir
+
+
+async def main():
+    query = 'Write a script about the Ortheans'
+    save_dir = SAVE_DIR
+    try:
+        if VARIANTS:
+            save_dir = await run_variants(query, VARIANTS, save_dir=SAVE_DIR)
+        else:
+            save_dir = await run_job(query, save_dir=SAVE_DIR)
+    finally:
+        await close_clients()
+        get_metrics().export(save_dir or Path(".cache/metrics"))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
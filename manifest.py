@@ -0,0 +1,88 @@
+from pathlib import Path
+from hashlib import sha256
+import os
+import sqlite3
+import time
+
+
+def file_checksum(path: Path) -> str:
+    digest = sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Journal of the artifacts a run has finished writing.
+
+    An entry is only recorded once its file has been renamed into place, so
+    anything on disk without an entry is an interrupted write and is ignored.
+    Entries carry size, checksum, duration and the producing stage and store
+    key, which is all a resumed run needs to know without opening the
+    artifacts themselves.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.db.execute("CREATE TABLE IF NOT EXISTS artifacts ("
+                        "stage TEXT, name TEXT, path TEXT, key TEXT, size INTEGER, "
+                        "checksum TEXT, duration_ms REAL, created REAL, "
+                        "PRIMARY KEY (stage, name))")
+        self.db.commit()
+
+    def record(self, stage: str, name: str, path: Path, key: str = None,
+               checksum: str = None, duration_ms: float = None):
+        path = Path(path)
+        if checksum is None:
+            checksum = file_checksum(path)
+        self.db.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (stage, name, Path(os.path.relpath(path, self.path.parent)).as_posix(), key,
+                         path.stat().st_size, checksum, duration_ms, time.time()))
+        self.db.commit()
+
+    def _entries(self, where: str, params: tuple, intact: bool = True) -> dict[str, dict]:
+        rows = self.db.execute("SELECT name, path, key, size, checksum, duration_ms "
+                               f"FROM artifacts WHERE {where}", params)
+        entries = {}
+        for name, path, key, size, checksum, duration_ms in rows:
+            # paths outside the run directory, such as the artifact store's,
+            # are relative to it too
+            path = Path(os.path.normpath(self.path.parent / path))
+            # a size check is enough to spot deleted or truncated files
+            # without reading them; `verify` compares checksums
+            if not path.exists() or (intact and path.stat().st_size != size):
+                continue
+            entries[name] = {'path': path, 'key': key, 'size': size,
+                             'checksum': checksum, 'duration_ms': duration_ms}
+        return entries
+
+    def entries(self, stage: str) -> dict[str, dict]:
+        return self._entries("stage = ?", (stage,))
+
+    def get(self, stage: str, name: str, intact: bool = True) -> dict:
+        return self._entries("stage = ? AND name = ?", (stage, name), intact).get(name)
+
+    def remove(self, stage: str, name: str):
+        self.db.execute("DELETE FROM artifacts WHERE stage = ? AND name = ?", (stage, name))
+        self.db.commit()
+
+    def verify(self) -> list[tuple[str, str]]:
+        """Drop the entries whose file no longer matches its checksum."""
+        broken = []
+        rows = self.db.execute("SELECT stage, name, path, checksum FROM artifacts").fetchall()
+        for stage, name, path, checksum in rows:
+            path = Path(os.path.normpath(self.path.parent / path))
+            if not path.exists() or file_checksum(path) != checksum:
+                broken.append((stage, name))
+                self.remove(stage, name)
+        return broken
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 2:
+        sys.exit("usage: python manifest.py <run_dir>")
+    for stage, name in Manifest(Path(sys.argv[1]) / "manifest.sqlite").verify():
+        print(f"dropped {stage}/{name}: missing or corrupt.")
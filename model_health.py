@@ -0,0 +1,85 @@
+from limits import THROTTLE_STATUSES, status_of
+from telemetry import get_logger, get_metrics
+import logging
+import time
+
+# consecutive failures that open a model's circuit, and how long it stays
+# open before one probe is let through
+FAILURE_THRESHOLD = 3
+COOLDOWN_SECONDS = 300.0
+
+logger = get_logger("ModelHealth", logging.INFO)
+
+_trackers = {}
+
+
+def is_outage(error: Exception) -> bool:
+    """Whether `error` says a model can't serve requests (throttling, quota,
+    server errors, timeouts, lost connections), as opposed to one request
+    being refused or its clip failing to generate or download."""
+    status = status_of(error)
+    if status is not None:
+        return status in THROTTLE_STATUSES or status >= 500
+    import httpx
+    return isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError))
+
+
+class ModelHealth:
+    """Circuit breaker per model, shared by every agent of a provider.
+
+    A model is skipped once it fails `failure_threshold` times in a row, or
+    at once when the provider keeps throttling it after the limiter's own
+    retries (quota exhausted). After `cooldown` seconds a single caller
+    is allowed through as a probe; its success closes the circuit again,
+    its failure reopens it for another cool-down.
+    """
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, cooldown: float = COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._models = {}
+
+    def _state(self, model: str) -> dict:
+        if model not in self._models:
+            self._models[model] = {'state': 'closed', 'failures': 0, 'opened_at': 0.0}
+        return self._models[model]
+
+    def available(self, model: str) -> bool:
+        """Whether a caller may use `model` now; may claim the probe slot."""
+        entry = self._state(model)
+        if entry['state'] == 'closed':
+            return True
+        now = time.monotonic()
+        if now - entry['opened_at'] >= self.cooldown:
+            # one probe per cool-down, so a probe that never reports back
+            # doesn't keep the model half open forever
+            entry.update(state='half_open', opened_at=now)
+            logger.info(f"probing {model}.")
+            return True
+        return False
+
+    def soonest(self, models: list[str]) -> str:
+        """The model whose cool-down ends first, for when none is available."""
+        return min(models, key=lambda model: self._state(model)['opened_at'])
+
+    def success(self, model: str):
+        entry = self._state(model)
+        if entry['state'] != 'closed':
+            logger.info(f"{model} recovered.")
+        entry.update(state='closed', failures=0)
+
+    def failure(self, model: str, error: Exception = None):
+        entry = self._state(model)
+        entry['failures'] += 1
+        throttled = error is not None and status_of(error) in THROTTLE_STATUSES
+        if entry['state'] == 'half_open' or throttled or entry['failures'] >= self.failure_threshold:
+            if entry['state'] != 'open':
+                logger.info(f"{model} unavailable for {self.cooldown:.0f}s after {entry['failures']} failures.")
+                get_metrics().inc('circuit_opened_total', model=model)
+            entry.update(state='open', opened_at=time.monotonic())
+
+
+def get_model_health(provider: str) -> ModelHealth:
+    if provider not in _trackers:
+        _trackers[provider] = ModelHealth()
+    return _trackers[provider]
@@ -1,17 +1,27 @@
 from abc import ABC, abstractmethod
-import json
+from telemetry import get_logger, get_metrics
 import logging
-import sys
 
 
 class Agent(ABC):
 
     def __init__(self, name, client, model):
         self.name = name
-        self.client = client
+        # None connects on first use, so that a run answered from caches
+        # never loads the provider's SDK
+        self._client = client
         self.model = model
         self.__init_logger()
 
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._connect()
+        return self._client
+
+    def _connect(self):
+        raise NotImplementedError(f"{type(self).__name__} needs a client.")
+
     @abstractmethod
     async def run(self, **kwargs):
         ...
@@ -19,15 +29,9 @@ class Agent(ABC):
     def log(self, msg: str, level: int = logging.DEBUG):
         self.logger.log(level=level, msg=msg)
 
+    def span(self, name: str, **labels):
+        return get_metrics().span(name, attrs={'agent': self.name},
+                                  kind=type(self).__name__, **labels)
+
     def __init_logger(self):
-        self.logger = logging.getLogger(self.name)
-        self.logger.setLevel(logging.DEBUG)
-        self.logger.propagate = False
-        logger_handler = logging.StreamHandler(sys.stdout)
-        logger_handler.setLevel(logging.DEBUG)
-        logger_formatter = logging.Formatter(
-            '[%(asctime)s](%(levelname)s) %(name)s: %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
-        logger_handler.setFormatter(logger_formatter)
-        self.logger.addHandler(logger_handler)
+        self.logger = get_logger(self.name)
@@ -0,0 +1,155 @@
+from audio import AudioArtifact
+from assembly import FFMPEG, run_command
+import asyncio
+import math
+import numpy as np
+
+SAMPLE_RATE = 44100
+# narration is trimmed to the first and last 10 ms frame louder than this
+SILENCE_THRESHOLD_DB = -50.0
+FRAME_MS = 10
+# silence kept before the first word, so the attack isn't clipped
+LEAD_MS = 50
+TARGET_LUFS = -16.0
+# the gain is capped so that no sample goes above this
+PEAK_DB = -1.0
+# gap left after the last word, so consecutive chunks are evenly spaced
+GAP_MS = 250
+MP3_BITRATE = "128k"
+# silence libmp3lame puts before the first sample, taken off the lead so the
+# encoded narration is no longer than the trimmed one
+ENCODER_DELAY = 1105
+
+# BS.1770 K-weighting: a high shelf and a high pass, given as the analog
+# prototypes so that they hold at any sample rate
+SHELF = {'gain_db': 3.999843853973347, 'q': 0.7071752369554196, 'frequency': 1681.974450955533}
+HIGH_PASS = {'q': 0.5003270373238773, 'frequency': 38.13547087602444}
+BLOCK_SECONDS = 0.4
+BLOCK_STEP = 0.1
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+
+def frame_levels(samples: np.ndarray, sample_rate: int, frame_ms: int = FRAME_MS) -> np.ndarray:
+    """RMS level in dBFS of each consecutive `frame_ms` frame."""
+    size = sample_rate * frame_ms // 1000
+    count = len(samples) // size
+    if count == 0:
+        return np.full(1, -np.inf)
+    frames = samples[:count * size].reshape(count, size)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    with np.errstate(divide='ignore'):
+        return 20 * np.log10(rms)
+
+
+def voiced_bounds(samples: np.ndarray, sample_rate: int, threshold_db: float = SILENCE_THRESHOLD_DB,
+                  frame_ms: int = FRAME_MS) -> tuple[int, int]:
+    """Sample range from the first to the last frame above `threshold_db`."""
+    voiced = np.flatnonzero(frame_levels(samples, sample_rate, frame_ms) > threshold_db)
+    if len(voiced) == 0:
+        return 0, 0
+    size = sample_rate * frame_ms // 1000
+    return int(voiced[0]) * size, min(len(samples), (int(voiced[-1]) + 1) * size)
+
+
+def _biquad_response(b: tuple, a: tuple, frequencies: np.ndarray, sample_rate: int) -> np.ndarray:
+    z = np.exp(-1j * 2 * np.pi * frequencies / sample_rate)
+    return (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+
+
+def k_weighting(frequencies: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Complex response of the K-weighting filter at `frequencies`."""
+    k = np.tan(np.pi * SHELF['frequency'] / sample_rate)
+    q = SHELF['q']
+    high = 10 ** (SHELF['gain_db'] / 20)
+    band = high ** 0.4996667741545416
+    shelf = _biquad_response((high + band * k / q + k * k, 2 * (k * k - high), high - band * k / q + k * k),
+                             (1 + k / q + k * k, 2 * (k * k - 1), 1 - k / q + k * k),
+                             frequencies, sample_rate)
+    k = np.tan(np.pi * HIGH_PASS['frequency'] / sample_rate)
+    q = HIGH_PASS['q']
+    a0 = 1 + k / q + k * k
+    # the numerator is left unnormalised, as in the standard's coefficients
+    high_pass = _biquad_response((1, -2, 1), (1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0),
+                                 frequencies, sample_rate)
+    return shelf * high_pass
+
+
+def loudness(samples: np.ndarray, sample_rate: int) -> float:
+    """Integrated loudness in LUFS (ITU-R BS.1770, mono), or -inf for silence.
+
+    The filter is applied in the frequency domain and block energies come
+    from a cumulative sum, so there is no per-sample Python loop.
+    """
+    if len(samples) == 0:
+        return -math.inf
+    # zero padding keeps the filter's tail from wrapping around, and a
+    # power of two keeps the FFT fast
+    n = 1 << (len(samples) + sample_rate // 10 - 1).bit_length()
+    spectrum = np.fft.rfft(samples, n) * k_weighting(np.fft.rfftfreq(n, 1 / sample_rate), sample_rate)
+    weighted = np.fft.irfft(spectrum, n)[:len(samples)]
+
+    block = int(BLOCK_SECONDS * sample_rate)
+    energy = np.concatenate(([0.0], np.cumsum(weighted.astype(np.float64) ** 2)))
+    if len(samples) < block:
+        powers = np.array([energy[-1] / len(samples)])
+    else:
+        starts = np.arange(0, len(samples) - block + 1, int(BLOCK_STEP * sample_rate))
+        powers = (energy[starts + block] - energy[starts]) / block
+    with np.errstate(divide='ignore'):
+        levels = -0.691 + 10 * np.log10(powers)
+    gated = powers[levels > ABSOLUTE_GATE]
+    if len(gated) == 0:
+        return -math.inf
+    relative = -0.691 + 10 * np.log10(np.mean(gated)) + RELATIVE_GATE
+    with np.errstate(divide='ignore'):
+        gated = gated[-0.691 + 10 * np.log10(gated) > relative]
+    return float(-0.691 + 10 * np.log10(np.mean(gated)))
+
+
+def process_samples(samples: np.ndarray, sample_rate: int, target_lufs: float = TARGET_LUFS,
+                    gap_ms: int = GAP_MS, lead_ms: int = LEAD_MS,
+                    threshold_db: float = SILENCE_THRESHOLD_DB, peak_db: float = PEAK_DB) -> np.ndarray:
+    """Trim the silence around `samples`, bring them to `target_lufs` and
+    pad them with `lead_ms` before and `gap_ms` after."""
+    start, end = voiced_bounds(samples, sample_rate, threshold_db)
+    voiced = samples[start:end]
+    current = loudness(voiced, sample_rate)
+    if math.isfinite(current) and len(voiced):
+        gain = 10 ** ((target_lufs - current) / 20)
+        peak = np.max(np.abs(voiced))
+        if peak > 0:
+            gain = min(gain, 10 ** (peak_db / 20) / peak)
+        voiced = voiced * gain
+    lead = np.zeros(sample_rate * lead_ms // 1000, dtype=np.float32)
+    gap = np.zeros(sample_rate * gap_ms // 1000, dtype=np.float32)
+    return np.concatenate((lead, voiced.astype(np.float32), gap))
+
+
+async def decode(data: bytes, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    pcm = await run_command(FFMPEG, "-v", "error", "-i", "pipe:0", "-f", "f32le", "-ac", "1",
+                            "-ar", str(sample_rate), "pipe:1", input=data)
+    return np.frombuffer(pcm, dtype=np.float32)
+
+
+async def encode(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    return await run_command(FFMPEG, "-v", "error", "-f", "f32le", "-ac", "1", "-ar", str(sample_rate),
+                             "-i", "pipe:0", "-c:a", "libmp3lame", "-b:a", MP3_BITRATE,
+                             "-write_xing", "0", "-id3v2_version", "0", "-f", "mp3", "pipe:1",
+                             input=samples.astype(np.float32).tobytes())
+
+
+async def process_narration(audios: list[AudioArtifact], target_lufs: float = TARGET_LUFS,
+                            gap_ms: int = GAP_MS, sample_rate: int = SAMPLE_RATE) -> list[AudioArtifact]:
+    """Trim, normalise and pad the narration of several chunks as one batch.
+
+    Decoding and encoding run as parallel ffmpeg processes; the NumPy work
+    runs in threads, so the event loop keeps serving other stages.
+    """
+    decoded = await asyncio.gather(*[decode(audio.read_bytes(), sample_rate) for audio in audios])
+    lead_ms = max(0, LEAD_MS - ENCODER_DELAY * 1000 // sample_rate)
+    processed = await asyncio.gather(*[asyncio.to_thread(process_samples, samples, sample_rate,
+                                                         target_lufs, gap_ms, lead_ms)
+                                       for samples in decoded])
+    encoded = await asyncio.gather(*[encode(samples, sample_rate) for samples in processed])
+    return [AudioArtifact(data) for data in encoded]
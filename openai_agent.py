@@ -1,10 +1,22 @@
 from my_agents import Agent
 from pydantic import BaseModel
-from utils import read_prompt
-import openai
-import os
+from prompts import get_prompt_registry
+from clients import get_openai_client
+from limits import AdaptiveLimiter, get_limiter
+from rag_cache import LocalRetriever, get_retrieval_cache
+from response_cache import ResponseCache, get_response_cache
+from telemetry import get_metrics
 import logging
-import asyncio
+
+INPUT_FORMAT = """\n\nYour input will be structured as a sequence of key-value pairs as follows:
+### <KEY1> ###
+<VALUE1>
+
+### <KEY2> ###
+<VALUE2>
+
+...
+"""
 
 
 class OpenaiAgent(Agent):
@@ -15,40 +27,36 @@ class OpenaiAgent(Agent):
                  api_key: str = None,
                  vector_store_id: int = None,
                  structured_text: BaseModel = None,
-                 semaphore: asyncio.Semaphore = None,
-                 settings: dict = None):
-        if api_key is None:
-            api_key = os.getenv("OPENAI_API_KEY")
-        client = openai.AsyncOpenAI(api_key=api_key)
-        super().__init__(name, client, model)
-        self.semaphore = semaphore
+                 limiter: AdaptiveLimiter = None,
+                 settings: dict = None,
+                 retrieval: str = "remote",
+                 cache: ResponseCache = None):
+        super().__init__(name, None, model)
+        self.api_key = api_key
+        self.cache = cache if cache is not None else get_response_cache()
+        self.limiter = limiter if limiter is not None else get_limiter('openai', model)
         self.system_prompt = system_prompt
         self.vector_store_id = vector_store_id
+        # "remote" searches the vector store (through the retrieval cache),
+        # "local" searches a synced snapshot of it without network calls
+        self.retrieval = retrieval
         self.structured_text = structured_text
         self.settings = settings if settings is not None else {}
 
-        self.system_prompt += """\n\nYour input will be structured as a sequence of key-value pairs as follows:
-### <KEY1> ###
-<VALUE1>
+        self.system_prompt += INPUT_FORMAT
 
-### <KEY2> ###
-<VALUE2>
+    def _connect(self):
+        return get_openai_client(self.api_key)
 
-...
-"""
+    def _system_prompt(self, **kwargs) -> str:
+        return self.system_prompt
 
     async def run(self, query: str = None, **kwargs):
-        if self.semaphore is None:
+        with self.span('agent_run'):
             result = await self._run(query, **kwargs)
-            return result
-
-        async with self.semaphore:
-            result = await self._run(query, **kwargs)
-            return result
-
-    async def _run(self, query: str = None, **kwargs):
-        self.log("started.", logging.INFO)
+        return result
 
+    async def _prompt(self, query: str = None, **kwargs) -> str:
         inputs = kwargs.copy()
         if query is not None:
             inputs['knowledge'] = await self._rag(query)
@@ -61,14 +69,40 @@ class OpenaiAgent(Agent):
             prompt += f"{v}\n\n"
 
         prompt += "### answer ###"
+        return prompt
+
+    def _record_usage(self, usage):
+        if usage is not None:
+            get_metrics().inc('tokens_total', usage.input_tokens, model=self.model, type='input')
+            get_metrics().inc('tokens_total', usage.output_tokens, model=self.model, type='output')
+
+    async def _run(self, query: str = None, **kwargs):
+        self.log("started.", logging.INFO)
+
+        system_prompt = self._system_prompt(**kwargs)
+        prompt = await self._prompt(query, **kwargs)
+        key = self.cache.key(self.model, system_prompt, prompt,
+                             self.structured_text, self.settings)
+        result = self.cache.get(key, self.structured_text)
+        get_metrics().inc('response_cache_total', result='miss' if result is None else 'hit')
+        if result is not None:
+            self.log("response found in cache.")
+            self.log("completed.", logging.INFO)
+            return result
+
         self.log("awaiting for response.")
+        # only requests that miss the cache wait for a slot
+        result = await self.limiter.call(self._request, system_prompt, prompt)
+        self.cache.put(key, self.model, result)
+        self.log("completed.", logging.INFO)
+        return result
 
-        result = None
+    async def _request(self, system_prompt: str, prompt: str):
         if self.structured_text is not None:
             response = await self.client.responses.parse(
                 model=self.model,
                 input=[
-                    {'role': 'system', 'content': self.system_prompt},
+                    {'role': 'system', 'content': system_prompt},
                     {'role': 'user', 'content': prompt}
                 ],
                 text_format=self.structured_text,
@@ -80,7 +114,7 @@ class OpenaiAgent(Agent):
             response = await self.client.responses.create(
                 model=self.model,
                 input=[
-                    {'role': 'system', 'content': self.system_prompt},
+                    {'role': 'system', 'content': system_prompt},
                     {'role': 'user', 'content': prompt}
                 ],
                 **self.settings
@@ -88,23 +122,74 @@ class OpenaiAgent(Agent):
             self.log("returned unstructured response.")
             result = response.output_text
 
-        self.log("completed.", logging.INFO)
+        self._record_usage(response.usage)
         return result
 
+    async def stream(self, query: str = None, **kwargs):
+        """Yield the text of an unstructured response as it is generated.
+
+        The limiter slot is held only until the response starts streaming;
+        a cached response is yielded in one piece.
+        """
+        self.log("started streaming.", logging.INFO)
+        system_prompt = self._system_prompt(**kwargs)
+        prompt = await self._prompt(query, **kwargs)
+        key = self.cache.key(self.model, system_prompt, prompt, None, self.settings)
+        result = self.cache.get(key, None)
+        get_metrics().inc('response_cache_total', result='miss' if result is None else 'hit')
+        if result is not None:
+            self.log("response found in cache.")
+            yield result
+            self.log("completed.", logging.INFO)
+            return
+
+        stream = await self.limiter.call(
+            self.client.responses.create,
+            model=self.model,
+            input=[
+                {'role': 'system', 'content': system_prompt},
+                {'role': 'user', 'content': prompt}
+            ],
+            stream=True,
+            **self.settings
+        )
+        parts = []
+        async for event in stream:
+            if event.type == "response.output_text.delta":
+                parts.append(event.delta)
+                yield event.delta
+            elif event.type == "response.completed":
+                self._record_usage(event.response.usage)
+
+        self.cache.put(key, self.model, "".join(parts))
+        self.log("completed.", logging.INFO)
+
     async def _rag(self, query: str) -> str:
         if query is None:
             query = ""
         if self.vector_store_id is not None and query != "":
+            if self.retrieval == "local":
+                self.log("querying local vector store snapshot.")
+                context = LocalRetriever(self.vector_store_id).search(query)
+                return "\n\n".join(context)
+
+            cache = get_retrieval_cache()
+            context = cache.get(self.vector_store_id, query)
+            if context is not None:
+                self.log("vector store results found in cache.")
+                return "\n\n".join(context)
+
             self.log("querying vector store.")
-            query_result = await self.client.vector_stores.search(
-                vector_store_id=self.vector_store_id,
-                query=query)
+            query_result = await self.limiter.call(self.client.vector_stores.search,
+                                                   vector_store_id=self.vector_store_id,
+                                                   query=query)
             context = []
             for data in query_result.model_dump()['data']:
                 content = data['content']
                 for el in content:
                     ctx = el.get('text', "")
                     context.append(ctx)
+            cache.put(self.vector_store_id, query, context)
             self.log("finished querying vector store.")
             return "\n\n".join(context)
         elif query != "":
@@ -119,15 +204,20 @@ class WriterAgent(OpenaiAgent):
                  model: str,
                  vector_store_id: int,
                  api_key: str = None,
-                 settings: dict = None):
+                 limiter: AdaptiveLimiter = None,
+                 settings: dict = None,
+                 retrieval: str = "remote"):
         structured_text = None
-        super().__init__(name, model, read_prompt(self.__class__.__name__), api_key,
-                         vector_store_id, structured_text, settings)
+        super().__init__(name, model, get_prompt_registry().template(self.__class__.__name__), api_key,
+                         vector_store_id, structured_text, limiter, settings, retrieval)
 
     async def run(self, query):
         result = await super().run(query=query, question=query)
         return result
 
+    def stream(self, query):
+        return super().stream(query=query, question=query)
+
 
 class ChunkerSchema(BaseModel):
     descriptions: list[str]
@@ -138,11 +228,12 @@ class ChunkerAgent(OpenaiAgent):
                  name: str,
                  model: str,
                  api_key: str = None,
+                 limiter: AdaptiveLimiter = None,
                  settings: dict = None):
         vector_store_id = None
         structured_text = ChunkerSchema
-        super().__init__(name, model, read_prompt(self.__class__.__name__), api_key,
-                         vector_store_id, structured_text, settings)
+        super().__init__(name, model, get_prompt_registry().template(self.__class__.__name__), api_key,
+                         vector_store_id, structured_text, limiter, settings)
 
 
 class VeoPrompter(OpenaiAgent):
@@ -150,14 +241,21 @@ class VeoPrompter(OpenaiAgent):
                  name: str,
                  model: str,
                  api_key: str = None,
+                 limiter: AdaptiveLimiter = None,
                  settings: dict = None):
         vector_store_id = None
         structured_text = ChunkerSchema
-        super().__init__(name, model, read_prompt(self.__class__.__name__), api_key,
-                         vector_store_id, structured_text, settings)
+        super().__init__(name, model, get_prompt_registry().template(self.__class__.__name__), api_key,
+                         vector_store_id, structured_text, limiter, settings)
+
+    def _system_prompt(self, versions: int = None, **kwargs) -> str:
+        # {versions} is on the template's last line, so the rest of it is a
+        # prefix every request shares
+        return get_prompt_registry().render(self.__class__.__name__, versions=versions) + INPUT_FORMAT
 
     async def run(self, script: str, versions: int, context: str = None) -> ChunkerSchema:
-        result = await super().run(script=script, versions=versions, context=context)
+        # shared inputs first, so that requests start with the same prefix
+        result = await super().run(context=context, versions=versions, script=script)
         if context is None:
             return result
         result_list = result.model_dump()['descriptions']
@@ -167,3 +265,23 @@ class VeoPrompter(OpenaiAgent):
             augmented_list.append(prompt)
         new_result = ChunkerSchema(descriptions=augmented_list)
         return new_result
+
+
+class TranslatorAgent(OpenaiAgent):
+    def __init__(self,
+                 name: str,
+                 model: str,
+                 api_key: str = None,
+                 limiter: AdaptiveLimiter = None,
+                 settings: dict = None):
+        vector_store_id = None
+        structured_text = None
+        super().__init__(name, model, get_prompt_registry().template(self.__class__.__name__), api_key,
+                         vector_store_id, structured_text, limiter, settings)
+
+    def _system_prompt(self, language: str = None, **kwargs) -> str:
+        return get_prompt_registry().render(self.__class__.__name__, language=language) + INPUT_FORMAT
+
+    async def run(self, text: str, language: str) -> str:
+        result = await super().run(language=language, text=text)
+        return result.strip()
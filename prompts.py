@@ -0,0 +1,55 @@
+from pathlib import Path
+from hashlib import sha256
+import json
+import string
+
+# the variables each template may use; templates follow str.format syntax,
+# so a literal brace is written doubled
+TEMPLATE_VARIABLES = {
+    'WriterAgent': set(),
+    'ChunkerAgent': set(),
+    'VeoPrompter': {'versions'},
+    'TranslatorAgent': {'language'},
+}
+
+_registries = {}
+
+
+class PromptRegistry:
+    """The system prompts in `prompts.json`, read and checked once.
+
+    Every template listed in TEMPLATE_VARIABLES must be present and use no
+    other variables, so a typo fails at startup rather than in a request.
+    `hash()` identifies a template's content for cache keys.
+    """
+
+    def __init__(self, path: Path = Path("prompts.json")):
+        self.path = Path(path)
+        with open(self.path) as f:
+            self.templates = json.load(f)
+        self.hashes = {}
+        for name, variables in TEMPLATE_VARIABLES.items():
+            template = self.templates.get(name)
+            if not isinstance(template, str) or not template.strip():
+                raise ValueError(f"{self.path}: missing prompt {name!r}.")
+            used = {field for _, field, _, _ in string.Formatter().parse(template) if field is not None}
+            if used - variables:
+                raise ValueError(f"{self.path}: prompt {name!r} uses unknown variables {sorted(used - variables)}.")
+        for name, template in self.templates.items():
+            self.hashes[name] = sha256(template.encode()).hexdigest()
+
+    def template(self, name: str) -> str:
+        return self.templates[name]
+
+    def render(self, name: str, **variables) -> str:
+        return self.templates[name].format(**variables)
+
+    def hash(self, name: str) -> str:
+        return self.hashes[name]
+
+
+def get_prompt_registry(path: Path = Path("prompts.json")) -> PromptRegistry:
+    key = str(path)
+    if key not in _registries:
+        _registries[key] = PromptRegistry(path)
+    return _registries[key]
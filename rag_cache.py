@@ -0,0 +1,177 @@
+from pathlib import Path
+import asyncio
+import json
+import math
+import re
+import sqlite3
+import sys
+import time
+
+RAG_TTL = 7 * 24 * 3600
+SNAPSHOT_CHUNK_CHARS = 1200
+
+_caches = {}
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+class RetrievalCache:
+    """Persistent cache of vector store search results.
+
+    Results are keyed by (vector_store_id, normalized query) and expire after
+    `ttl` seconds; `invalidate` drops a store's entries, and `refresh` does so
+    whenever the store's files changed since the last check.
+    """
+
+    def __init__(self, path: Path = Path(".cache/rag.sqlite"), ttl: float = RAG_TTL):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("CREATE TABLE IF NOT EXISTS retrievals ("
+                        "vector_store_id TEXT, query TEXT, result TEXT, created REAL, "
+                        "PRIMARY KEY (vector_store_id, query))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS stores ("
+                        "vector_store_id TEXT PRIMARY KEY, fingerprint TEXT)")
+        self.db.commit()
+
+    def get(self, vector_store_id: str, query: str) -> list[str]:
+        row = self.db.execute("SELECT result, created FROM retrievals WHERE vector_store_id = ? AND query = ?",
+                              (vector_store_id, normalize_query(query))).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def put(self, vector_store_id: str, query: str, result: list[str]):
+        self.db.execute("INSERT OR REPLACE INTO retrievals VALUES (?, ?, ?, ?)",
+                        (vector_store_id, normalize_query(query), json.dumps(result), time.time()))
+        self.db.commit()
+
+    def invalidate(self, vector_store_id: str = None):
+        if vector_store_id is None:
+            self.db.execute("DELETE FROM retrievals")
+        else:
+            self.db.execute("DELETE FROM retrievals WHERE vector_store_id = ?", (vector_store_id,))
+        self.db.commit()
+
+    async def refresh(self, client, vector_store_id: str) -> bool:
+        store = await client.vector_stores.retrieve(vector_store_id)
+        # last_active_at changes on every search, so it is left out
+        fingerprint = json.dumps([store.usage_bytes, store.file_counts.model_dump()])
+        row = self.db.execute("SELECT fingerprint FROM stores WHERE vector_store_id = ?",
+                              (vector_store_id,)).fetchone()
+        changed = row is None or row[0] != fingerprint
+        if changed:
+            self.invalidate(vector_store_id)
+            self.db.execute("INSERT OR REPLACE INTO stores VALUES (?, ?)", (vector_store_id, fingerprint))
+            self.db.commit()
+        return changed
+
+
+class LocalRetriever:
+    """BM25 search over a local snapshot of a vector store's files.
+
+    The snapshot is written by `sync` and lets writers run offline against a
+    stand-in for `vector_stores.search`.
+    """
+
+    def __init__(self, vector_store_id: str, snapshot_dir: Path = Path(".cache/rag")):
+        self.vector_store_id = vector_store_id
+        self.path = Path(snapshot_dir) / f"{vector_store_id}.json"
+        self._chunks = None
+
+    @property
+    def chunks(self) -> list[dict]:
+        if self._chunks is None:
+            if not self.path.exists():
+                raise FileNotFoundError(f"no local snapshot of {self.vector_store_id}, run "
+                                        f"`python rag_cache.py sync {self.vector_store_id}`.")
+            self._chunks = json.loads(self.path.read_text())
+            for chunk in self._chunks:
+                chunk['tokens'] = tokenize(chunk['text'])
+        return self._chunks
+
+    async def sync(self, client) -> int:
+        chunks = []
+        async for f in client.vector_stores.files.list(self.vector_store_id):
+            text = ""
+            async for part in client.vector_stores.files.content(f.id, vector_store_id=self.vector_store_id):
+                text += part.text or ""
+            for piece in split_text(text):
+                chunks.append({'file_id': f.id, 'text': piece})
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(chunks))
+        self._chunks = None
+        return len(chunks)
+
+    def search(self, query: str, k: int = 10) -> list[str]:
+        chunks = self.chunks
+        terms = set(tokenize(query))
+        if not chunks or not terms:
+            return []
+        avg_len = sum(len(c['tokens']) for c in chunks) / len(chunks)
+        df = {t: sum(1 for c in chunks if t in c['tokens']) for t in terms}
+
+        def score(tokens):
+            total = 0.0
+            for t in terms:
+                tf = tokens.count(t)
+                if tf == 0:
+                    continue
+                idf = math.log(1 + (len(chunks) - df[t] + 0.5) / (df[t] + 0.5))
+                total += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * len(tokens) / avg_len))
+            return total
+
+        scored = sorted(((score(c['tokens']), c['text']) for c in chunks), reverse=True)
+        return [text for s, text in scored[:k] if s > 0]
+
+
+def split_text(text: str, size: int = SNAPSHOT_CHUNK_CHARS) -> list[str]:
+    pieces = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        if current and len(current) + len(paragraph) > size:
+            pieces.append(current.strip())
+            current = ""
+        current += paragraph + "\n\n"
+    if current.strip():
+        pieces.append(current.strip())
+    return pieces
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    if 'default' not in _caches:
+        _caches['default'] = RetrievalCache()
+    return _caches['default']
+
+
+async def _cli(command: str, vector_store_id: str):
+    from clients import get_openai_client, close_clients
+    client = get_openai_client()
+    try:
+        if command == "sync":
+            n = await LocalRetriever(vector_store_id).sync(client)
+            get_retrieval_cache().invalidate(vector_store_id)
+            print(f"synced {n} chunks of {vector_store_id}.")
+        elif command == "refresh":
+            changed = await get_retrieval_cache().refresh(client, vector_store_id)
+            print("invalidated." if changed else "unchanged.")
+        elif command == "invalidate":
+            get_retrieval_cache().invalidate(vector_store_id)
+            print("invalidated.")
+        else:
+            sys.exit(f"unknown command {command}.")
+    finally:
+        await close_clients()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python rag_cache.py sync|refresh|invalidate <vector_store_id>")
+    asyncio.run(_cli(sys.argv[1], sys.argv[2]))
@@ -0,0 +1,121 @@
+from clip_index import normalize_description
+from utils import write_atomic
+from pathlib import Path
+from hashlib import sha256
+import io
+import json
+import re
+import sys
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+# Veo takes at most three asset references per request
+MAX_REFERENCES = 3
+MAX_SIDE = 1280
+JPEG_QUALITY = 85
+
+_libraries = {}
+
+
+def tags_of(name: str) -> list[str]:
+    return [t for t in re.findall(r"[a-z0-9]+", name.lower()) if not t.isdigit()]
+
+
+def stem(tag: str) -> str:
+    # so that `ortheans` also matches `orthean`
+    return tag[:-1] if len(tag) > 4 and tag.endswith("s") else tag
+
+
+def prepare_image(data: bytes, max_side: int = MAX_SIDE, quality: int = JPEG_QUALITY) -> bytes:
+    """Downscale to at most `max_side` pixels and recompress as JPEG."""
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    image.thumbnail((max_side, max_side))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+
+class ReferenceLibrary:
+    """Reference images for Veo, prepared once and picked per description.
+
+    Every image in `directory` is downscaled and recompressed into
+    `cache_dir`, keyed by the hash of its content. An index in the same
+    place keeps each file's hash and tags, so unchanged files are neither
+    read nor converted again. Tags come from the file name
+    (`ortheans.jpg` -> `ortheans`) plus any captions listed for it in
+    `directory/tags.json`, as {"ortheans.jpg": ["orthean", "tidal city"]}.
+    """
+
+    def __init__(self, directory: Path = Path("references"),
+                 cache_dir: Path = Path(".cache/references")):
+        self.directory = Path(directory)
+        self.cache_dir = Path(cache_dir)
+        self.index_path = self.cache_dir / "index.json"
+        self.entries = {}
+
+    def refresh(self) -> dict:
+        if not self.directory.exists():
+            self.entries = {}
+            return self.entries
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        index = json.loads(self.index_path.read_text()) if self.index_path.exists() else {}
+        captions_path = self.directory / "tags.json"
+        captions = json.loads(captions_path.read_text()) if captions_path.exists() else {}
+
+        entries = {}
+        for f in sorted(self.directory.iterdir()):
+            if f.suffix.lower() not in IMAGE_SUFFIXES:
+                continue
+            stat = f.stat()
+            entry = index.get(f.name)
+            if (entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size
+                    or not (self.cache_dir / entry['file']).exists()):
+                data = f.read_bytes()
+                digest = sha256(data).hexdigest()
+                prepared = self.cache_dir / f"{digest}.jpg"
+                if not prepared.exists():
+                    write_atomic(prepared, prepare_image(data))
+                entry = {'hash': digest, 'file': prepared.name,
+                         'mtime': stat.st_mtime, 'size': stat.st_size}
+            tags = tags_of(f.stem)
+            for caption in captions.get(f.name, []):
+                tags += [t for t in tags_of(caption) if t not in tags]
+            entry['tags'] = tags
+            entries[f.name] = entry
+
+        if entries != index:
+            write_atomic(self.index_path, json.dumps(entries, indent=1).encode())
+        self.entries = entries
+        return entries
+
+    def select(self, description: str, k: int = MAX_REFERENCES) -> list[Path]:
+        """The prepared images whose tags the description mentions most.
+
+        Only the instructions take part, not the lore context VeoPrompter
+        prepends to every description, as it names everything.
+        """
+        words = normalize_description(description)
+        text = " ".join(words)
+        scored = []
+        for name, entry in self.entries.items():
+            score = sum(len(re.findall(rf"\b{re.escape(stem(tag))}(?:s|es)?\b", text)) for tag in entry['tags'])
+            if score:
+                scored.append((score, name))
+        scored.sort(key=lambda item: -item[0])
+        return [self.cache_dir / self.entries[name]['file'] for _, name in scored[:k]]
+
+
+def get_reference_library(directory: Path = Path("references")) -> ReferenceLibrary:
+    key = str(directory)
+    if key not in _libraries:
+        _libraries[key] = ReferenceLibrary(directory)
+        _libraries[key].refresh()
+    return _libraries[key]
+
+
+if __name__ == "__main__":
+    library = ReferenceLibrary(Path(sys.argv[1]) if len(sys.argv) > 1 else Path("references"))
+    for name, entry in library.refresh().items():
+        print(f"{name}: {entry['file']} {entry['tags']}")
@@ -0,0 +1,60 @@
+from pydantic import BaseModel
+from pathlib import Path
+from hashlib import sha256
+import json
+import sqlite3
+import time
+
+_caches = {}
+
+
+class ResponseCache:
+    """Single-file store of LLM responses keyed by everything that shapes them.
+
+    Structured responses are stored as JSON and validated back into their
+    pydantic schema. Hits and misses are counted by the agents, as the
+    `response_cache_total` metric.
+    """
+
+    def __init__(self, path: Path = Path(".cache/responses.sqlite")):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                        "key TEXT PRIMARY KEY, model TEXT, value TEXT, created REAL)")
+        self.db.commit()
+
+    @staticmethod
+    def key(model: str, system_prompt: str, prompt: str,
+            schema: type[BaseModel] = None, settings: dict = None) -> str:
+        payload = json.dumps({
+            'model': model,
+            'system_prompt': system_prompt,
+            'prompt': prompt,
+            'schema': None if schema is None else [schema.__name__, schema.model_json_schema()],
+            'settings': settings or {},
+        }, sort_keys=True, default=str)
+        return sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str, schema: type[BaseModel] = None):
+        row = self.db.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if schema is not None:
+            return schema.model_validate_json(row[0])
+        return json.loads(row[0])
+
+    def put(self, key: str, model: str, value):
+        if isinstance(value, BaseModel):
+            value = value.model_dump_json()
+        else:
+            value = json.dumps(value)
+        self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                        (key, model, value, time.time()))
+        self.db.commit()
+
+
+def get_response_cache() -> ResponseCache:
+    if 'default' not in _caches:
+        _caches['default'] = ResponseCache()
+    return _caches['default']
@@ -0,0 +1,159 @@
+from utils import write_atomic
+from contextlib import contextmanager
+from pathlib import Path
+from hashlib import sha256
+import contextvars
+import json
+import os
+import tempfile
+import time
+
+# temp files older than this were left by a run that crashed or was
+# cancelled; younger ones may still be written to by another process
+STALE_TEMP_SECONDS = 24 * 3600
+
+# the pin set of the job running in the current task, and every pin set
+# active in this process (see `ArtifactStore.pinned`)
+_pins = contextvars.ContextVar('pins', default=None)
+_pin_sets = []
+
+
+def stage_key(stage: str, **inputs) -> str:
+    payload = json.dumps({'stage': stage, **inputs},
+                         sort_keys=True, default=str)
+    return sha256(payload.encode()).hexdigest()
+
+
+class ArtifactStore:
+    """Content-addressed artifact store shared by every run.
+
+    Artifacts live under `.cache/store/<kind>/<key[:2]>/<key>.<ext>`, where
+    the key is a hash of the full inputs of the stage that produced them
+    (see `stage_key`). The store is kept under `max_bytes` by evicting the
+    least recently used artifacts; file mtimes double as access times so the
+    LRU order survives across processes. Runs refer to artifacts in place
+    rather than keeping copies, so the budget covers every byte they use,
+    and the artifacts a running job has touched are pinned until it ends.
+    """
+
+    def __init__(self, basedir: str = ".", max_bytes: int = None):
+        self.root = Path(basedir) / ".cache" / "store"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._index = {}
+        for f in self.root.glob("*/*/*"):
+            if f.is_file() and not f.name.startswith("."):
+                stat = f.stat()
+                self._index[f] = (stat.st_mtime, stat.st_size)
+        self._remove_stale_temps()
+        self._size = sum(size for _, size in self._index.values())
+
+    def path(self, kind: str, key: str, ext: str) -> Path:
+        return self.root / kind / key[:2] / f"{key}.{ext}"
+
+    def get(self, kind: str, key: str, ext: str) -> Path:
+        path = self.path(kind, key, ext)
+        if not path.exists():
+            self._forget(path)
+            return None
+        self._touch(path)
+        self.pin(path)
+        return path
+
+    def put(self, kind: str, key: str, ext: str, data: bytes) -> Path:
+        path = self.path(kind, key, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(path, data)
+
+        self._forget(path)
+        self._index[path] = (path.stat().st_mtime, len(data))
+        self._size += len(data)
+        self.pin(path)
+        self._evict(keep=path)
+        return path
+
+    def temp_path(self, kind: str, ext: str) -> Path:
+        # temp files live inside the store so `put_file` is a same-filesystem rename
+        directory = self.root / kind
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=f".{ext}")
+        os.close(fd)
+        return Path(tmp)
+
+    def put_file(self, kind: str, key: str, ext: str, src: Path) -> Path:
+        path = self.path(kind, key, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(src, path)
+
+        size = path.stat().st_size
+        self._forget(path)
+        self._index[path] = (path.stat().st_mtime, size)
+        self._size += size
+        self.pin(path)
+        self._evict(keep=path)
+        return path
+
+    def delete(self, kind: str, key: str, ext: str):
+        path = self.path(kind, key, ext)
+        path.unlink(missing_ok=True)
+        self._forget(path)
+
+    def get_json(self, kind: str, key: str):
+        path = self.get(kind, key, "json")
+        if path is None:
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def put_json(self, kind: str, key: str, value) -> Path:
+        return self.put(kind, key, "json", json.dumps(value).encode())
+
+    @contextmanager
+    def pinned(self):
+        """Keep the artifacts read, written or `pin`ned in this context, and
+        in the tasks started from it, from being evicted until it exits."""
+        pins = set()
+        token = _pins.set(pins)
+        _pin_sets.append(pins)
+        try:
+            yield pins
+        finally:
+            _pin_sets.remove(pins)
+            _pins.reset(token)
+
+    def pin(self, path: Path):
+        pins = _pins.get()
+        if pins is not None:
+            pins.add(Path(path))
+
+    def _remove_stale_temps(self):
+        now = time.time()
+        for f in list(self.root.glob("*/.*")) + list(self.root.glob("*/*/.*")):
+            try:
+                if f.name.startswith((".tmp_", ".hedge_")) and now - f.stat().st_mtime > STALE_TEMP_SECONDS:
+                    f.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _touch(self, path: Path):
+        os.utime(path)
+        size = self._index.get(path, (None, path.stat().st_size))[1]
+        if path not in self._index:
+            self._size += size
+        self._index[path] = (path.stat().st_mtime, size)
+
+    def _forget(self, path: Path):
+        entry = self._index.pop(path, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def _evict(self, keep: Path = None):
+        if self.max_bytes is None or self._size <= self.max_bytes:
+            return
+        for path, _ in sorted(self._index.items(), key=lambda item: item[1][0]):
+            if self._size <= self.max_bytes:
+                break
+            if path == keep or any(path in pins for pins in _pin_sets):
+                continue
+            path.unlink(missing_ok=True)
+            self._forget(path)
@@ -0,0 +1,218 @@
+from pathlib import Path
+import json
+import sqlite3
+import time
+
+LEASE_SECONDS = 60.0
+MAX_ATTEMPTS = 3
+
+
+class TaskQueue:
+    """Durable task queue in a SQLite file, shared by worker processes.
+
+    Tasks are claimed with a lease that the worker extends by heartbeats;
+    a task whose lease runs out (its worker died or hung) is claimed again
+    by someone else, up to `max_attempts` times. A task only becomes
+    claimable once every task it depends on is done, and fails along with
+    any of them. Tasks with the same `key` are submitted only once, so a
+    retried task can safely resubmit its follow-ups. Any number of
+    processes, on one machine or several sharing the file system, can use
+    the same file.
+    """
+
+    def __init__(self, path: Path = Path(".cache/queue.sqlite")):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS tasks ("
+                        "id INTEGER PRIMARY KEY, key TEXT UNIQUE, type TEXT, job TEXT, payload TEXT, "
+                        "status TEXT, priority INTEGER, attempts INTEGER, max_attempts INTEGER, "
+                        "owner TEXT, lease_expires REAL, error TEXT, created REAL, updated REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS dependencies ("
+                        "task INTEGER, dependency INTEGER, PRIMARY KEY (task, dependency))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, priority, id)")
+
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so two workers can't
+        # both read a task as free and then both claim it
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def submit(self, task_type: str, payload: dict, key: str = None, job: str = None,
+               after: list[int] = (), before: list[int] = (), priority: int = 0,
+               max_attempts: int = MAX_ATTEMPTS) -> int:
+        """Submit a task that waits for the tasks in `after`, and that the
+        tasks in `before` wait for; returns the id of the task with `key`
+        instead if there is one, adding the `before` dependencies to it."""
+        self._transaction()
+        try:
+            task_id = self._submit(task_type, payload, key, job, after, before, priority, max_attempts)
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return task_id
+
+    def _submit(self, task_type, payload, key, job, after, before, priority, max_attempts) -> int:
+        task_id = self.find(key) if key is not None else None
+        if task_id is None:
+            now = time.time()
+            cursor = self.db.execute("INSERT INTO tasks (key, type, job, payload, status, priority, attempts, "
+                                     "max_attempts, created, updated) "
+                                     "VALUES (?, ?, ?, ?, 'pending', ?, 0, ?, ?, ?)",
+                                     (key, task_type, job, json.dumps(payload), priority, max_attempts, now, now))
+            task_id = cursor.lastrowid
+            for dependency in after:
+                self._depend(task_id, dependency)
+        for dependent in before:
+            self._depend(dependent, task_id)
+        return task_id
+
+    def find(self, key: str) -> int:
+        row = self.db.execute("SELECT id FROM tasks WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _depend(self, task_id: int, dependency: int):
+        self.db.execute("INSERT OR IGNORE INTO dependencies VALUES (?, ?)", (task_id, dependency))
+        row = self.db.execute("SELECT status FROM tasks WHERE id = ?", (dependency,)).fetchone()
+        # a task waiting on a failed one would never become claimable
+        if row is not None and row[0] == 'failed':
+            self._fail_dependents(dependency)
+
+    def claim(self, owner: str, types: list[str] = None, lease: float = LEASE_SECONDS) -> dict:
+        now = time.time()
+        query = ("SELECT id, type, job, payload, attempts FROM tasks t "
+                 "WHERE (status = 'pending' OR (status = 'running' AND lease_expires < ? "
+                 "AND attempts < max_attempts)) "
+                 "AND NOT EXISTS (SELECT 1 FROM dependencies d JOIN tasks u ON u.id = d.dependency "
+                 "WHERE d.task = t.id AND u.status != 'done')")
+        params = [now]
+        if types:
+            query += f" AND type IN ({', '.join('?' for _ in types)})"
+            params += list(types)
+        query += " ORDER BY priority DESC, id LIMIT 1"
+
+        self._transaction()
+        try:
+            # tasks whose every attempt ran out of lease won't be retried
+            expired = self.db.execute("SELECT id FROM tasks WHERE status = 'running' AND lease_expires < ? "
+                                      "AND attempts >= max_attempts", (now,)).fetchall()
+            for (task_id,) in expired:
+                self.db.execute("UPDATE tasks SET status = 'failed', error = 'lease expired', updated = ? "
+                                "WHERE id = ?", (now, task_id))
+                self._fail_dependents(task_id)
+            row = self.db.execute(query, params).fetchone()
+            if row is None:
+                self.db.execute("COMMIT")
+                return None
+            task_id, task_type, job, payload, attempts = row
+            self.db.execute("UPDATE tasks SET status = 'running', owner = ?, lease_expires = ?, "
+                            "attempts = attempts + 1, updated = ? WHERE id = ?",
+                            (owner, now + lease, now, task_id))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return {'id': task_id, 'type': task_type, 'job': job, 'payload': json.loads(payload),
+                'attempt': attempts + 1}
+
+    def heartbeat(self, task_id: int, owner: str, lease: float = LEASE_SECONDS) -> bool:
+        """Extend the lease; False means the task was taken over by someone else."""
+        now = time.time()
+        cursor = self.db.execute("UPDATE tasks SET lease_expires = ?, updated = ? "
+                                 "WHERE id = ? AND owner = ? AND status = 'running'",
+                                 (now + lease, now, task_id, owner))
+        return cursor.rowcount == 1
+
+    def complete(self, task_id: int, owner: str) -> bool:
+        cursor = self.db.execute("UPDATE tasks SET status = 'done', lease_expires = NULL, updated = ? "
+                                 "WHERE id = ? AND owner = ? AND status = 'running'",
+                                 (time.time(), task_id, owner))
+        return cursor.rowcount == 1
+
+    def fail(self, task_id: int, owner: str, error: str):
+        """Put the task back for another attempt, or fail it and its dependents."""
+        self._transaction()
+        try:
+            row = self.db.execute("SELECT attempts, max_attempts FROM tasks "
+                                  "WHERE id = ? AND owner = ? AND status = 'running'",
+                                  (task_id, owner)).fetchone()
+            if row is not None:
+                status = 'pending' if row[0] < row[1] else 'failed'
+                self.db.execute("UPDATE tasks SET status = ?, owner = NULL, lease_expires = NULL, "
+                                "error = ?, updated = ? WHERE id = ?", (status, error, time.time(), task_id))
+                if status == 'failed':
+                    self._fail_dependents(task_id)
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def _fail_dependents(self, task_id: int):
+        pending = [task_id]
+        while pending:
+            failed = pending.pop()
+            rows = self.db.execute("SELECT d.task FROM dependencies d JOIN tasks t ON t.id = d.task "
+                                   "WHERE d.dependency = ? AND t.status IN ('pending', 'running')",
+                                   (failed,)).fetchall()
+            for (dependent,) in rows:
+                self.db.execute("UPDATE tasks SET status = 'failed', error = ?, updated = ? WHERE id = ?",
+                                (f"task {failed} failed", time.time(), dependent))
+                pending.append(dependent)
+
+    def counts(self, job: str = None) -> dict:
+        query = "SELECT type, status, COUNT(*) FROM tasks"
+        params = ()
+        if job is not None:
+            query += " WHERE job = ?"
+            params = (job,)
+        counts = {}
+        for task_type, status, count in self.db.execute(query + " GROUP BY type, status", params):
+            counts.setdefault(task_type, {})[status] = count
+        return counts
+
+    def idle(self) -> bool:
+        row = self.db.execute("SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'running')").fetchone()
+        return row[0] == 0
+
+
+def check_queue(path: Path):
+    """Lease expiry, retries and dependencies on a fresh queue at `path`."""
+    queue = TaskQueue(path)
+    first = queue.submit('a', {}, key="first", max_attempts=2)
+    second = queue.submit('b', {}, key="second", after=[first])
+    assert queue.submit('a', {}, key="first") == first
+    assert queue.claim("w1", types=['b']) is None, "a task was claimed before its dependency"
+
+    # a lease that runs out hands the task to another worker, which the
+    # first one finds out at its next heartbeat
+    task = queue.claim("w1", lease=0.0)
+    assert task['id'] == first and task['attempt'] == 1
+    task = queue.claim("w2")
+    assert task['id'] == first and task['attempt'] == 2
+    assert not queue.heartbeat(first, "w1") and queue.heartbeat(first, "w2")
+    assert queue.complete(first, "w2")
+    assert queue.claim("w1")['id'] == second
+
+    # a failure is retried until its attempts run out, then fails the
+    # tasks waiting for it, including ones added after it failed
+    third = queue.submit('c', {}, key="third", max_attempts=2)
+    queue.submit('d', {}, key="fourth", after=[third])
+    for _ in range(2):
+        assert queue.claim("w1", types=['c'])['id'] == third
+        queue.fail(third, "w1", "error")
+    late = queue.submit('e', {}, key="late")
+    assert queue.submit('c', {}, key="third", before=[late]) == third
+    statuses = dict(queue.db.execute("SELECT key, status FROM tasks").fetchall())
+    assert statuses['third'] == statuses['fourth'] == statuses['late'] == 'failed', statuses
+    assert queue.complete(second, "w1") and queue.idle()
+
+
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            check_queue(Path(directory) / "queue.sqlite")
+        except AssertionError as e:
+            raise SystemExit(f"queue check failed: {e}")
+    print("queue checks passed.")
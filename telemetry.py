@@ -0,0 +1,156 @@
+from logging.handlers import QueueHandler, QueueListener
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+METRIC_PREFIX = "earth_archives"
+
+_queue_handler = None
+_listener = None
+
+
+def _handler() -> QueueHandler:
+    # every logger shares one queue; a background thread writes the records,
+    # so logging never blocks the event loop on stdout
+    global _queue_handler, _listener
+    if _queue_handler is None:
+        log_queue = queue.SimpleQueue()
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(logging.Formatter(
+            '[%(asctime)s](%(levelname)s) %(name)s: %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        ))
+        _queue_handler = QueueHandler(log_queue)
+        _listener = QueueListener(log_queue, stream_handler)
+        _listener.start()
+        atexit.register(_listener.stop)
+    return _queue_handler
+
+
+def get_logger(name: str, level: int = logging.DEBUG) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.propagate = False
+    handler = _handler()
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+    return logger
+
+
+class Metrics:
+    """Counters, timing summaries and a trace of spans for one process.
+
+    Labels passed to `inc`, `observe` and `span` become Prometheus labels,
+    so they should stay low-cardinality (stage, provider, model); per-call
+    details such as the agent name go in `attrs` and only reach the trace.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.summaries = defaultdict(lambda: [0, 0.0])
+        self.events = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(metric: str, labels: dict):
+        return metric, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def inc(self, metric: str, value: float = 1, **labels):
+        with self._lock:
+            self.counters[self._key(metric, labels)] += value
+
+    def observe(self, metric: str, value: float, **labels):
+        with self._lock:
+            summary = self.summaries[self._key(metric, labels)]
+            summary[0] += 1
+            summary[1] += value
+
+    @contextmanager
+    def span(self, name: str, attrs: dict = None, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.observe(f"{name}_seconds", duration, **labels)
+            with self._lock:
+                self.events.append({
+                    'name': name,
+                    'start': start - self._origin,
+                    'duration': duration,
+                    'labels': labels,
+                    'attrs': attrs or {},
+                })
+
+    def export_json(self, path: Path):
+        # Chrome trace-event format, readable by Perfetto or chrome://tracing
+        trace_events = []
+        for event in self.events:
+            args = {**event['labels'], **event['attrs']}
+            track = event['attrs'].get('agent') or event['labels'].get('stage') or event['name']
+            trace_events.append({
+                'name': event['name'] if 'stage' not in event['labels'] else event['labels']['stage'],
+                'ph': 'X',
+                'ts': round(event['start'] * 1e6),
+                'dur': round(event['duration'] * 1e6),
+                'pid': os.getpid(),
+                'tid': track,
+                'args': args,
+            })
+        metrics = {
+            'counters': [{'metric': m, 'labels': dict(labels), 'value': v}
+                         for (m, labels), v in self.counters.items()],
+            'summaries': [{'metric': m, 'labels': dict(labels), 'count': c, 'sum': s}
+                          for (m, labels), (c, s) in self.summaries.items()],
+        }
+        Path(path).write_text(json.dumps({'traceEvents': trace_events, 'metrics': metrics}, indent=1))
+
+    def export_prometheus(self, path: Path):
+        def series(metric, labels, suffix=""):
+            name = f"{METRIC_PREFIX}_{metric}{suffix}"
+            if not labels:
+                return name
+            rendered = ",".join(f'{k}="{v}"' for k, v in labels)
+            return f"{name}{{{rendered}}}"
+
+        lines = []
+        typed = set()
+        for (metric, labels), value in sorted(self.counters.items()):
+            if metric not in typed:
+                lines.append(f"# TYPE {METRIC_PREFIX}_{metric} counter")
+                typed.add(metric)
+            lines.append(f"{series(metric, labels)} {value}")
+        for (metric, labels), (count, total) in sorted(self.summaries.items()):
+            if metric not in typed:
+                lines.append(f"# TYPE {METRIC_PREFIX}_{metric} summary")
+                typed.add(metric)
+            lines.append(f"{series(metric, labels, '_count')} {count}")
+            lines.append(f"{series(metric, labels, '_sum')} {total}")
+
+        # write then rename, as the textfile collector may read at any time
+        path = Path(path)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text("\n".join(lines) + "\n")
+        os.replace(tmp, path)
+
+    def export(self, directory: Path):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.export_json(directory / "trace.json")
+        self.export_prometheus(directory / "metrics.prom")
+
+
+metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return metrics
@@ -1,131 +1,135 @@
 from pathlib import Path
 from datetime import datetime
 import json
-from pydub import AudioSegment
-from hashlib import md5
-
-
-def read_prompt(name: str):
-    with open("prompts.json") as f:
-        prompts = json.load(f)
-
-    prompt = prompts.get(name, None)
-    return prompt
+from audio import AudioArtifact
+from manifest import Manifest
+from hashlib import md5, sha256
+import os
+import tempfile
 
 
 def generate_hash(string: str):
     return md5(string.encode()).hexdigest()
 
 
-def get_references(dir):
-    references = []
-    path = Path(dir)
-    if not path.exists():
-        return references
-
-    for f in path.iterdir():
-        filebytes = f.read_bytes()
-        references.append(filebytes)
-
-    return references
+def write_atomic(path: Path, data: bytes):
+    # readers only ever see the old file or the complete new one
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp_")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
 
 
 class Cacher:
-    def __init__(self, basedir: str = ".", save_dir: Path = None):
-        if save_dir is not None and isinstance(save_dir, Path) and save_dir.exists():
-            self.save_dir = save_dir
-            return
+    """Per-run record of a job's artifacts, used to resume it.
+
+    Every file is written under a temporary name and renamed into place, then
+    recorded in the run's manifest; audio and clips are recorded where they
+    are in the artifact store rather than copied, and one the store has
+    evicted since is simply made again. `restore` works from the manifest alone,
+    so half-written files from a crashed run are never picked up. Derived
+    artifacts are recorded with the key of their inputs, so an edit to the
+    script only invalidates what was made from the text that changed.
+    """
+
+    def __init__(self, basedir: str = ".", save_dir: Path = None, run_id: str = None):
+        if save_dir is None or not (isinstance(save_dir, Path) and save_dir.exists()):
+            cache = Path(basedir) / Path(".cache")
+            cache.mkdir(exist_ok=True)
+
+            if run_id is not None:
+                save_dir = cache / "runs" / run_id
+                save_dir.mkdir(parents=True, exist_ok=True)
+            else:
+                save_dir = cache / \
+                    Path(f"{datetime.now().strftime('%Y%m%d%H%M%S')}_safe")
+                save_dir.mkdir(exist_ok=True)
 
-        cache = Path(basedir) / Path(".cache")
-        cache.mkdir(exist_ok=True)
+        self.save_dir = save_dir
+        self.manifest = Manifest(save_dir / "manifest.sqlite")
 
-        save_dir = cache / \
-            Path(f"{datetime.now().strftime('%Y%m%d%H%M%S')}_safe")
-        save_dir.mkdir(exist_ok=True)
+    def _save_json(self, stage: str, name: str, path: Path, value, key: str = None):
+        data = json.dumps(value).encode()
+        write_atomic(path, data)
+        self.manifest.record(stage, name, path, key=key, checksum=sha256(data).hexdigest())
 
-        self.save_dir = save_dir
+    def _restore_json(self, stage: str, name: str):
+        entry = self.manifest.get(stage, name)
+        if entry is None:
+            return None
+        with open(entry['path']) as f:
+            return json.load(f)
+
+    def current(self, stage: str, name: str, key: str) -> bool:
+        """Whether the recorded artifact was derived from inputs hashing to `key`."""
+        entry = self.manifest.get(stage, name)
+        return entry is not None and entry['key'] == key
 
     def save_script(self, script: str):
-        with open(self.save_dir / "script.txt", "w") as f:
-            f.write(script)
+        path = self.save_dir / "script.txt"
+        data = script.encode()
+        write_atomic(path, data)
+        self.manifest.record('script', 'script', path, checksum=sha256(data).hexdigest())
 
-    def save_chunks(self, chunks: dict):
-        with open(self.save_dir / "chunks.json", "w") as f:
-            json.dump(chunks, f)
+    def save_chunks(self, chunks: dict, script_hash: str = None):
+        self._save_json('chunks', 'chunks', self.save_dir / "chunks.json", chunks, key=script_hash)
 
-    def save_audio(self, audios: dict[str, AudioSegment]):
-        audio_dir = self.save_dir / "audio"
-        audio_dir.mkdir(exist_ok=True)
+    def save_audio(self, audios: dict[str, AudioArtifact]):
         for n, audio in audios.items():
-            name = audio_dir / f"{n}.mp3"
-            audio.export(str(name), format='mp3')
-
-    def save_descriptions(self, descriptions: dict):
-        with open(self.save_dir / "descriptions.json", "w") as f:
-            json.dump(descriptions, f)
-
-    def save_videos(self, videos: dict[str, bytearray]):
-        video_dir = self.save_dir / "video"
-        video_dir.mkdir(exist_ok=True)
-        for n, video in videos.items():
-            name = video_dir / f"{n}.mp4"
-            with open(str(name), "wb") as f:
-                f.write(video)
+            # store files are named after their stage key
+            self.manifest.record('audio', n, audio.path, key=audio.path.stem,
+                                 duration_ms=audio.duration_ms)
+
+    def save_descriptions(self, chunk: str, descriptions: list[str], key: str = None):
+        description_dir = self.save_dir / "descriptions"
+        description_dir.mkdir(exist_ok=True)
+        n = generate_hash(chunk)
+        self._save_json('descriptions', n, description_dir / f"{n}.json",
+                        {'chunk': chunk, 'descriptions': descriptions}, key=key)
+
+    def save_videos(self, videos: dict[str, Path], keys: dict[str, str] = None):
+        # a clip reused for a similar description is recorded with the key
+        # it was wanted for, not the one it was made for
+        keys = keys or {}
+        for n, path in videos.items():
+            self.manifest.record('video', n, path, key=keys.get(n, Path(path).stem))
 
     def restore_script(self):
-        script_path = self.save_dir / "script.txt"
-        if not script_path.exists():
+        # the script is the one artifact meant to be edited by hand, so an
+        # edit is picked up rather than treated as a broken file
+        entry = self.manifest.get('script', 'script', intact=False)
+        if entry is None:
             return None
-        script = script_path.read_text()
-        return script
+        return entry['path'].read_text()
 
     def restore_chunks(self):
-        chunks_path = self.save_dir / "chunks.json"
-        if not chunks_path.exists():
-            return None
-        with open(chunks_path) as f:
-            chunks = json.load(f)
-
-        return chunks
+        return self._restore_json('chunks', 'chunks')
 
     def restore_audio(self):
-        audio_dir = self.save_dir / "audio"
-        if not audio_dir.exists():
+        entries = self.manifest.entries('audio')
+        if not entries:
             return None
-        audios = {}
-        for f in audio_dir.iterdir():
-            name = f.stem
-            audio = AudioSegment.from_mp3(f)
-            audios[name] = audio
-
-        return audios
-
-    def restore_descriptions(self):
-        descriptions_path = self.save_dir / "descriptions.json"
-        if not descriptions_path.exists():
+        # durations come from the manifest, so nothing is decoded on resume
+        return {n: AudioArtifact(path=e['path'], duration_ms=e['duration_ms'])
+                for n, e in entries.items()}
+
+    def restore_descriptions(self, chunk: str, key: str):
+        """`chunk`'s descriptions, if they were made from inputs hashing to `key`."""
+        n = generate_hash(chunk)
+        if not self.current('descriptions', n, key):
             return None
-        with open(descriptions_path) as f:
-            descriptions = json.load(f)
-
-        return descriptions
+        return self._restore_json('descriptions', n)['descriptions']
 
     def restore_videos(self):
-        video_dir = self.save_dir / "video"
-        if not video_dir.exists():
+        entries = self.manifest.entries('video')
+        if not entries:
             return None
-        videos = {}
-        for f in video_dir.iterdir():
-            name = f.stem
-            video = f.read_bytes()
-            videos[name] = video
-
-        return videos
+        return {n: e['path'] for n, e in entries.items()}
 
     def restore(self):
         script = self.restore_script()
         chunks = self.restore_chunks()
         audios = self.restore_audio()
-        description = self.restore_descriptions()
         videos = self.restore_videos()
 
-        return script, chunks, audios, description, videos
+        return script, chunks, audios, videos
@@ -0,0 +1,133 @@
+from telemetry import get_logger, get_metrics
+import asyncio
+import logging
+import time
+
+logger = get_logger("VeoPoller", logging.INFO)
+
+# Veo generations usually take one to two minutes
+EXPECTED_SECONDS = 90.0
+MIN_INTERVAL = 2.0
+MAX_INTERVAL = 30.0
+
+_pollers = {}
+
+
+class VeoPoller:
+    """Polls every pending Veo operation of one client from a single task.
+
+    Each operation is polled sparsely until it nears the expected completion
+    time of its model (a running average of the jobs seen so far), then
+    every `min_interval` seconds, backing off slowly once it is overdue.
+    """
+
+    def __init__(self,
+                 client,
+                 expected: float = EXPECTED_SECONDS,
+                 min_interval: float = MIN_INTERVAL,
+                 max_interval: float = MAX_INTERVAL,
+                 max_errors: int = 5):
+        self.client = client
+        self.default_expected = expected
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_errors = max_errors
+        self.expected = {}
+        self._pending = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def _expected(self, model: str) -> float:
+        return self.expected.get(model, self.default_expected)
+
+    def _record(self, model: str, duration: float):
+        previous = self.expected.get(model)
+        self.expected[model] = duration if previous is None else 0.7 * previous + 0.3 * duration
+
+    def _interval(self, model: str, elapsed: float) -> float:
+        expected = self._expected(model)
+        if elapsed < 0.8 * expected:
+            interval = 0.8 * expected - elapsed
+        else:
+            interval = self.min_interval * (1 + max(0.0, elapsed - expected) / expected)
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    async def wait(self, operation, model: str, submitted_at: float = None):
+        """Wait until `operation` is done and return its final state.
+
+        `submitted_at` is a `time.time()` timestamp, so operations resumed
+        after a restart are scheduled by their real age.
+        """
+        if submitted_at is None:
+            submitted_at = time.time()
+        future = asyncio.get_running_loop().create_future()
+        # several agents may wait on one operation, e.g. two runs sharing a clip
+        if operation.name in self._pending:
+            self._pending[operation.name]['futures'].append(future)
+            return await future
+        elapsed = time.time() - submitted_at
+        self._pending[operation.name] = {
+            'operation': operation,
+            'model': model,
+            'futures': [future],
+            'started': time.monotonic() - elapsed,
+            'next_poll': time.monotonic() + self._interval(model, elapsed),
+            'errors': 0,
+        }
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+        self._wakeup.set()
+        return await future
+
+    async def _poll(self, name: str, entry: dict):
+        now = time.monotonic()
+        try:
+            operation = await self.client.aio.operations.get(entry['operation'])
+        except Exception as e:
+            entry['errors'] += 1
+            if entry['errors'] >= self.max_errors:
+                self._pending.pop(name, None)
+                for future in entry['futures']:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            logger.info(f"polling {name} failed: {e}")
+            operation = entry['operation']
+        get_metrics().inc('veo_polls_total', model=entry['model'])
+
+        elapsed = now - entry['started']
+        if operation.done:
+            self._pending.pop(name, None)
+            self._record(entry['model'], elapsed)
+            for future in entry['futures']:
+                if not future.done():
+                    future.set_result(operation)
+            return
+        entry['operation'] = operation
+        entry['next_poll'] = time.monotonic() + self._interval(entry['model'], elapsed)
+
+    async def _loop(self):
+        while self._pending:
+            now = time.monotonic()
+            # waiters that were cancelled don't need polling any more
+            for name in [n for n, e in self._pending.items() if all(f.done() for f in e['futures'])]:
+                self._pending.pop(name)
+            due = [(n, e) for n, e in self._pending.items() if e['next_poll'] <= now]
+            if due:
+                await asyncio.gather(*[self._poll(n, e) for n, e in due])
+                continue
+            if not self._pending:
+                break
+            delay = min(e['next_poll'] for e in self._pending.values()) - now
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+def get_poller(client) -> VeoPoller:
+    key = id(client)
+    if key not in _pollers:
+        _pollers[key] = VeoPoller(client, EXPECTED_SECONDS, MIN_INTERVAL, MAX_INTERVAL)
+    return _pollers[key]
@@ -1,74 +1,232 @@
 from my_agents import Agent
-from google.genai import types
-from google import genai
-import os
+from clients import get_genai_client, get_genai_http_client
+from limits import AdaptiveLimiter, get_limiter
+from veo_poller import get_poller
+from model_health import ModelHealth, get_model_health, is_outage
+from store import ArtifactStore
+from telemetry import get_metrics
+from pathlib import Path
 import asyncio
-from io import BytesIO
 import logging
+import os
+import tempfile
+import time
 
 
 class VideoGenerationAgent(Agent):
+    MODEL_NAMES = ["veo-3.0-generate-001",
+                   "veo-3.0-fast-generate-001", "veo-2.0-generate-001"]
+    # model a hedged generation is also submitted to
+    HEDGE_MODELS = {"veo-3.0-generate-001": "veo-3.0-fast-generate-001"}
+    # models that accept asset reference images; the others get the prompt alone
+    REFERENCE_MODELS = {"veo-2.0-generate-001"}
+
     def __init__(self,
                  name: str,
                  api_key: str = None,
-                 semaphore: asyncio.Semaphore = None,
-                 references: list = [],
-                 settings: dict = None):
+                 limiter: AdaptiveLimiter = None,
+                 references: list[Path] = [],
+                 store: ArtifactStore = None,
+                 settings: dict = None,
+                 health: ModelHealth = None,
+                 hedge_after: float = None):
 
         if api_key is None:
             api_key = os.getenv("GOOGLE_API_KEY")
-        client = genai.Client(api_key=api_key)
-        model_names = ["veo-3.0-generate-001",
-                       "veo-3.0-fast-generate-001", "veo-2.0-generate-001"]
-        super().__init__(name, client, model_names)
-        self.semaphore = semaphore
-        google_references = []
-        if references:
-            google_references = [types.VideoGenerationReferenceImage(image=types.Image(
-                image_bytes=img), reference_type='asset') for img in references]
+        super().__init__(name, None, list(self.MODEL_NAMES))
+        self.api_key = api_key
+        # None means one shared limiter per Veo model
+        self.limiter = limiter
+        # shared by every video agent, so a failing model is found out once
+        self.health = health if health is not None else get_model_health('veo')
+        # seconds to wait on a model before also submitting to its hedge
+        self.hedge_after = hedge_after
+        # accepted operations are recorded here so a restarted run resumes
+        # them instead of paying for a new generation
+        self.store = store
+        # prepared reference images (see references.py), read when submitting
+        # to a model in REFERENCE_MODELS
+        self.references = [Path(p) for p in references]
         self.settings = settings if settings is not None else {}
-        if google_references:
-            self.settings['reference_images'] = google_references
 
-    async def run(self, prompt: str):
-        if self.semaphore is None:
-            result = await self._run(prompt,)
-            return result
+    def _connect(self):
+        return get_genai_client(self.api_key)
 
-        async with self.semaphore:
-            result = await self._run(prompt)
-            return result
+    @property
+    def poller(self):
+        return get_poller(self.client)
 
-    async def _run(self, prompt: str):
+    async def run(self, prompt: str, key: str = None, dest: Path = None) -> Path:
+        """Generate a clip for `prompt` and stream it to `dest`.
+
+        Returns the path of the downloaded clip; without `dest` it is written
+        to a new temporary file.
+        """
+        with self.span('agent_run'):
+            return await self._run(prompt, key, dest)
+
+    async def _run(self, prompt: str, key: str = None, dest: Path = None) -> Path:
         self.log("started.", logging.INFO)
+        if dest is None:
+            fd, tmp = tempfile.mkstemp(suffix=".mp4")
+            os.close(fd)
+            dest = Path(tmp)
+
+        try:
+            if key is not None and self.store is not None:
+                video_path = await self._resume(key, dest)
+                if video_path is not None:
+                    self.log("completed.", logging.INFO)
+                    return video_path
+
+            for model in self._models():
+                try:
+                    self.log(f"trying model {model}")
+                    video_path = await self._generate(model, prompt, dest, key)
+                    self.log("completed.", logging.INFO)
+                    return video_path
+
+                except Exception as e:
+                    self.log(f"model {model} failed: {e}")
+                    continue
+
+            raise Exception("couldn't generate video.")
+        except BaseException:
+            # a failed or cancelled run leaves no partial download behind
+            dest.unlink(missing_ok=True)
+            raise
+
+    def _models(self):
+        # availability is checked right before each attempt, so a model's
+        # probe slot is only claimed when it is actually tried
+        tried = False
         for model in self.model:
-            try:
-                # Use async version of generate_videos
-                self.log(f"trying model {model}")
-                operation = await self.client.aio.models.generate_videos(
-                    model=model,
-                    prompt=prompt,
-                    config=types.GenerateVideosConfig(**self.settings)
-                )
+            if self.health.available(model):
+                tried = True
+                yield model
+        if not tried:
+            yield self.health.soonest(self.model)
+
+    async def _generate(self, model: str, prompt: str, dest: Path, key: str = None) -> Path:
+        primary = asyncio.create_task(self._attempt(model, prompt, dest, key))
+        hedge_model = self.HEDGE_MODELS.get(model)
+        if self.hedge_after is None or hedge_model is None:
+            return await primary
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        except BaseException:
+            # asyncio.wait doesn't cancel what it waits for
+            primary.cancel()
+            raise
+        if done or not self.health.available(hedge_model):
+            return await primary
+
+        self.log(f"{model} is over its latency budget, hedging with {hedge_model}.", logging.INFO)
+        get_metrics().inc('veo_hedges_total', model=hedge_model)
+        hedge_dest = dest.with_name(f".hedge_{dest.name}")
+        hedge = asyncio.create_task(self._attempt(hedge_model, prompt, hedge_dest))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    for other in pending:
+                        other.cancel()
+                    await asyncio.gather(*pending, return_exceptions=True)
+                    if task is hedge:
+                        os.replace(hedge_dest, dest)
+                        if key is not None and self.store is not None:
+                            self.store.delete('veo_operation', key, 'json')
+                    return dest
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            hedge_dest.unlink(missing_ok=True)
 
-                # Poll asynchronously
-                while not operation.done:
-                    await asyncio.sleep(10)  # Non-blocking sleep
-                    operation = await self.client.aio.operations.get(operation)
+    async def _attempt(self, model: str, prompt: str, dest: Path, key: str = None) -> Path:
+        limiter = self.limiter if self.limiter is not None else get_limiter('veo', model)
+        try:
+            # the limiter slot is held only until Veo accepts the job
+            operation = await limiter.call(self._submit, model, prompt)
+            submitted_at = time.time()
+            if key is not None and self.store is not None:
+                self.store.put_json('veo_operation', key, {'name': operation.name,
+                                                           'model': model,
+                                                           'submitted_at': submitted_at})
+            video_path = await self._complete(operation, model, submitted_at, dest, key)
+        except Exception as e:
+            # a prompt the model refuses says nothing about the model itself
+            if is_outage(e):
+                self.health.failure(model, e)
+            raise
+        self.health.success(model)
+        return video_path
 
-                generated_video = operation.response.generated_videos[0]
+    async def _resume(self, key: str, dest: Path):
+        record = self.store.get_json('veo_operation', key)
+        if record is None:
+            return None
+        self.log(f"resuming operation {record['name']}")
+        from google.genai import types
+        operation = types.GenerateVideosOperation(name=record['name'])
+        try:
+            return await self._complete(operation, record['model'], record['submitted_at'], dest, key)
+        except Exception as e:
+            self.log(f"resuming operation {record['name']} failed: {e}")
+            self.store.delete('veo_operation', key, 'json')
+            return None
 
-                # Download asynchronously - populates video_bytes
-                video_buffer = await self.client.aio.files.download(file=generated_video.video)
+    async def _submit(self, model: str, prompt: str):
+        from google.genai import types
+        config = dict(self.settings)
+        if self.references and model in self.REFERENCE_MODELS:
+            config['reference_images'] = [types.VideoGenerationReferenceImage(
+                image=types.Image(image_bytes=path.read_bytes(), mime_type="image/jpeg"),
+                reference_type='asset') for path in self.references]
+        # Use async version of generate_videos
+        operation = await self.client.aio.models.generate_videos(
+            model=model,
+            prompt=prompt,
+            config=types.GenerateVideosConfig(**config)
+        )
+        return operation
 
-                # # Access the bytes
-                # video_buffer = BytesIO(generated_video.video.video_bytes)
+    async def _complete(self, operation, model: str, submitted_at: float, dest: Path, key: str = None):
+        operation = await self.poller.wait(operation, model, submitted_at)
+        if key is not None and self.store is not None:
+            self.store.delete('veo_operation', key, 'json')
+        if operation.error or not operation.response or not operation.response.generated_videos:
+            raise Exception(f"operation {operation.name} failed: {operation.error}")
 
-                self.log("completed.", logging.INFO)
-                return video_buffer
+        generated_video = operation.response.generated_videos[0]
+        await self._download(generated_video.video, dest)
+        return dest
 
-            except Exception as e:
-                self.log(f"model {model} failed: {e}")
-                continue
+    async def _download(self, video, dest: Path):
+        metrics = get_metrics()
+        if video.video_bytes:
+            dest.write_bytes(video.video_bytes)
+            metrics.inc('bytes_downloaded_total', len(video.video_bytes), provider='veo')
+            return
+        http_client = get_genai_http_client(self.api_key)
+        if not video.uri or http_client is None:
+            # Download asynchronously - populates video_bytes
+            video_bytes = await self.client.aio.files.download(file=video)
+            dest.write_bytes(video_bytes)
+            metrics.inc('bytes_downloaded_total', len(video_bytes), provider='veo')
+            return
 
-        raise Exception("couldn't generate video.")
+        # stream the file to disk instead of holding the clip in memory
+        async with http_client.stream("GET", video.uri,
+                                      headers={'x-goog-api-key': self.api_key},
+                                      follow_redirects=True) as response:
+            response.raise_for_status()
+            with open(dest, "wb") as f:
+                async for chunk in response.aiter_bytes():
+                    f.write(chunk)
+                    metrics.inc('bytes_downloaded_total', len(chunk), provider='veo')
@@ -0,0 +1,236 @@
+from task_queue import TaskQueue, LEASE_SECONDS
+from store import ArtifactStore
+from clients import close_clients
+from telemetry import get_logger, get_metrics
+from utils import Cacher, generate_hash
+from pathlib import Path
+import main
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import uuid
+
+QUEUE_PATH = Path(".cache/queue.sqlite")
+METRICS_DIR = Path(".cache/metrics")
+TASK_TYPES = ["script", "chunks", "voice", "prompt", "video", "assembly"]
+# seconds between claims when the queue has nothing for this worker
+POLL_SECONDS = 1.0
+
+logger = get_logger("Worker", logging.INFO)
+
+
+class Worker:
+    """Runs the pipeline's stages as tasks claimed from a TaskQueue.
+
+    A job starts as a `script` task; each task submits the ones that follow
+    from it, keyed by the run it belongs to so that retries don't submit
+    them twice. Stage results go to the artifact store and the job's run
+    directory, which every worker shares through the file system.
+    """
+
+    def __init__(self, queue: TaskQueue, owner: str, types: list[str] = None,
+                 concurrency: int = 8, lease: float = LEASE_SECONDS):
+        self.queue = queue
+        self.owner = owner
+        self.types = types
+        self.concurrency = concurrency
+        self.lease = lease
+        # no size budget: each worker would keep its own view of the store's
+        # size and pins, and could evict what another worker is using
+        self.store = ArtifactStore()
+        self.context = main.read_context()
+        self.references = main.get_reference_library(main.REFERENCES_DIR)
+        self.handlers = {
+            'script': self.script,
+            'chunks': self.chunks,
+            'voice': self.voice,
+            'prompt': self.prompt,
+            'video': self.video,
+            'assembly': self.assembly,
+        }
+
+    async def run(self, exit_when_idle: bool = False):
+        slots = asyncio.Semaphore(self.concurrency)
+        running = set()
+        while True:
+            await slots.acquire()
+            task = self.queue.claim(self.owner, self.types, self.lease)
+            if task is None:
+                slots.release()
+                if exit_when_idle and not running and self.queue.idle():
+                    return
+                await asyncio.sleep(POLL_SECONDS)
+                continue
+            job = asyncio.create_task(self.execute(task, slots))
+            running.add(job)
+            job.add_done_callback(running.discard)
+
+    async def execute(self, task: dict, slots: asyncio.Semaphore):
+        # what the task reads from the store stays there until it is done
+        with self.store.pinned():
+            await self._execute(task, slots)
+
+    async def _execute(self, task: dict, slots: asyncio.Semaphore):
+        handler = asyncio.create_task(self.handlers[task['type']](task))
+
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(self.lease / 3)
+                if not self.queue.heartbeat(task['id'], self.owner, self.lease):
+                    logger.info(f"lost the lease on task {task['id']}.")
+                    handler.cancel()
+                    return
+
+        beating = asyncio.create_task(heartbeat())
+        try:
+            with get_metrics().span('stage', attrs={'job': task['job'], 'task': task['id']}, stage=task['type']):
+                await handler
+            self.queue.complete(task['id'], self.owner)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"task {task['id']} ({task['type']}) failed: {e!r}")
+            self.queue.fail(task['id'], self.owner, repr(e))
+        finally:
+            beating.cancel()
+            slots.release()
+
+    def cacher(self, task: dict) -> Cacher:
+        return Cacher(run_id=task['job'])
+
+    def submit(self, task: dict, task_type: str, payload: dict, name: str, after: list[int] = (),
+               before: list[int] = ()) -> int:
+        payload = {'run': task['payload']['run'], 'query': task['payload']['query'], **payload}
+        return self.queue.submit(task_type, payload, key=f"{payload['run']}:{task_type}:{name}",
+                                 job=task['job'], after=after, before=before)
+
+    async def script(self, task: dict):
+        cacher = self.cacher(task)
+        if cacher.restore_script() is None:
+            script = await main.process_script(task['payload']['query'], self.store, task['job'])
+            cacher.save_script(script)
+        self.submit(task, 'chunks', {}, "chunks")
+
+    async def chunks(self, task: dict):
+        cacher = self.cacher(task)
+        script = cacher.restore_script()
+        chunks = cacher.restore_chunks()
+        if chunks is None or not cacher.current('chunks', 'chunks', generate_hash(script)):
+            chunks = await main.process_chunks(script, self.store, task['job'], previous=chunks)
+            cacher.save_chunks(chunks, generate_hash(script))
+
+        prompts = []
+        for i, chunk in enumerate(chunks):
+            payload = {'chunk': chunk, 'index': i}
+            voice = self.submit(task, 'voice', payload, generate_hash(chunk))
+            prompts.append(self.submit(task, 'prompt', payload, generate_hash(chunk), after=[voice]))
+        if main.ASSEMBLE:
+            # the clips are added as dependencies by the prompt tasks
+            self.submit(task, 'assembly', {}, "assembly", after=prompts)
+
+    async def voice(self, task: dict):
+        chunk, i = task['payload']['chunk'], task['payload']['index']
+        agent = main.make_voice_agent(main.agent_name(f"AudioGeneration_{i}", task['job']))
+        await main.generate_audio(agent, chunk, self.cacher(task), self.store)
+
+    async def prompt(self, task: dict):
+        chunk, i = task['payload']['chunk'], task['payload']['index']
+        cacher = self.cacher(task)
+        audio = cacher.restore_audio()[generate_hash(chunk)]
+        prompter = main.make_prompter(main.agent_name(f'Prompter_{i}', task['job']))
+        descriptions = await main.generate_descriptions(prompter, chunk, audio, self.context,
+                                                        self.store, cacher)
+
+        assembly = self.queue.find(f"{task['payload']['run']}:assembly")
+        for j, desc in enumerate(descriptions):
+            self.submit(task, 'video', {'chunk': chunk, 'index': i, 'clip': j, 'desc': desc},
+                        main.video_name(chunk, desc), before=[] if assembly is None else [assembly])
+
+    async def video(self, task: dict):
+        payload = task['payload']
+        agent = main.make_video_agent(main.agent_name(f"VideoGeneration_{payload['index']}_{payload['clip']}",
+                                                      task['job']),
+                                      self.store, main.select_references(self.references, payload['desc']))
+        await main.generate_video(agent, payload['chunk'], payload['desc'], self.cacher(task), self.store,
+                                 task['job'])
+
+    async def assembly(self, task: dict):
+        cacher = self.cacher(task)
+        chunks = cacher.restore_chunks()
+        audios = cacher.restore_audio()
+        descriptions = {}
+        for chunk in chunks:
+            audio = audios[generate_hash(chunk)]
+            key = main.descriptions_key(chunk, main.count_versions(audio),
+                                       main.chunk_context(chunk, self.context))
+            descriptions[chunk] = cacher.restore_descriptions(chunk, key)
+        videos = cacher.restore_videos()
+        for path in [audio.path for audio in audios.values()] + list(videos.values()):
+            self.store.pin(path)
+        await main.process_assembly(chunks, audios, descriptions, videos, cacher.save_dir / "short.mp4")
+
+
+def submit_jobs(queue: TaskQueue, queries: list[str]) -> list[int]:
+    task_ids = []
+    for query in queries:
+        job = generate_hash(query)
+        # every submission is a new run of the job; its tasks are keyed by it
+        run = f"{job}.{uuid.uuid4().hex[:8]}"
+        task_ids.append(queue.submit('script', {'query': query, 'run': run}, key=f"{run}:script", job=job))
+    return task_ids
+
+
+async def work(queue_path: Path, types: list[str], concurrency: int, exit_when_idle: bool):
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    worker = Worker(TaskQueue(queue_path), owner, types, concurrency)
+    logger.info(f"worker {owner} started.")
+    try:
+        await worker.run(exit_when_idle)
+    finally:
+        await close_clients()
+        get_metrics().export(METRICS_DIR / f"worker-{socket.gethostname()}-{os.getpid()}")
+
+
+def run_process(queue_path: Path, types: list[str], concurrency: int, exit_when_idle: bool):
+    asyncio.run(work(queue_path, types, concurrency, exit_when_idle))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the pipeline from a durable task queue.")
+    parser.add_argument("--queue", type=Path, default=QUEUE_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit = commands.add_parser("submit", help="queue jobs")
+    submit.add_argument("queries", nargs="+")
+    run = commands.add_parser("run", help="claim and run tasks")
+    run.add_argument("--processes", type=int, default=1, help="worker processes to start")
+    run.add_argument("--concurrency", type=int, default=8, help="tasks run at once per process")
+    run.add_argument("--types", nargs="+", choices=TASK_TYPES, help="only claim these task types")
+    run.add_argument("--exit-when-idle", action="store_true")
+    commands.add_parser("status", help="count tasks by type and status")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "submit":
+        for task_id, query in zip(submit_jobs(TaskQueue(args.queue), args.queries), args.queries):
+            print(f"queued {query!r} as task {task_id}.")
+    elif args.command == "status":
+        for task_type, counts in TaskQueue(args.queue).counts().items():
+            print(f"{task_type}: " + ", ".join(f"{status} {n}" for status, n in sorted(counts.items())))
+    elif args.processes == 1:
+        run_process(args.queue, args.types, args.concurrency, args.exit_when_idle)
+    else:
+        processes = [multiprocessing.Process(target=run_process,
+                                             args=(args.queue, args.types, args.concurrency,
+                                                   args.exit_when_idle))
+                     for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        sys.exit(max(process.exitcode for process in processes))